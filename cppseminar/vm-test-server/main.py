@@ -7,6 +7,7 @@ import json
 import os
 
 from vmtestserver.server import app
+from vmtestserver.requests import close_publisher
 
 logger = logging.getLogger(__name__)
 
@@ -73,3 +74,5 @@ if __name__ == '__main__':
         logger.info('Finished.')
     except KeyboardInterrupt:
         logger.info('Interrupted.')
+    finally:
+        close_publisher()
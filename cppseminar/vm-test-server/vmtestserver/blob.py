@@ -1,5 +1,7 @@
 import contextlib
 import urllib.request
+import threading
+import functools
 import os
 import datetime
 
@@ -7,6 +9,10 @@ from urllib.parse import urlparse
 from azure.storage.blob import BlobServiceClient, generate_blob_sas
 from azure.core.exceptions import ResourceExistsError
 
+# blobs larger than this are uploaded in blocks, several at once
+MAX_SINGLE_PUT_SIZE = 8 * 1024 * 1024
+MAX_BLOCK_SIZE = 4 * 1024 * 1024
+
 class AzureFileError(RuntimeError):
     pass
 
@@ -18,27 +24,49 @@ def download_file(url):
         raise AzureFileError('Cannot download file {}, ended with status {}.'.format(url, response.status))
 
 
-def upload_file_and_get_token(filepath, container, conn_str):
-    service = BlobServiceClient.from_connection_string(conn_str)
+@functools.lru_cache(maxsize=None)
+def _get_service(conn_str):
+    # clients are thread safe and keep their connection pool, so one is
+    # shared by all requests
+    return BlobServiceClient.from_connection_string(conn_str,
+        max_single_put_size=MAX_SINGLE_PUT_SIZE, max_block_size=MAX_BLOCK_SIZE)
+
+_created_containers = set()
+_containers_lock = threading.Lock()
+
+def _get_container(conn_str, container):
+    container_client = _get_service(conn_str).get_container_client(container)
 
-    container_client = service.get_container_client(container)
+    # containers are never deleted, it is enough to create them once
+    with _containers_lock:
+        if (conn_str, container) in _created_containers:
+            return container_client
 
     with contextlib.suppress(ResourceExistsError):
        container_client.create_container()
 
-    blob_client = container_client.get_blob_client(os.path.basename(filepath))
+    with _containers_lock:
+        _created_containers.add((conn_str, container))
+    return container_client
+
+
+def upload_and_get_token(data, name, container, conn_str, length=None):
+    """Uploads data (bytes or readable stream of length bytes) as blob name
+    and returns its url with read only token. Streams are read one block at
+    a time, so they do not have to be in memory as a whole."""
+    service = _get_service(conn_str)
+    blob_client = _get_container(conn_str, container).get_blob_client(name)
 
-    with open(filepath, 'rb') as f:
-        blob_client.upload_blob(f, timeout=300)
+    blob_client.upload_blob(data, length=length, timeout=300, max_concurrency=int(os.getenv('BLOB_MAX_CONCURRENCY', '4')))
 
-        uri = urlparse(blob_client.url)
-        blob_client_url = uri.scheme + '://' + uri.netloc + uri.path
+    uri = urlparse(blob_client.url)
+    blob_client_url = uri.scheme + '://' + uri.netloc + uri.path
 
-        return blob_client_url + "?" + generate_blob_sas(
-            blob_client.account_name,
-            blob_client.container_name,
-            blob_client.blob_name,
-            account_key=service.credential.account_key,
-            permission='r',
-            expiry=datetime.datetime.now() + datetime.timedelta(days=5),
-        )
+    return blob_client_url + "?" + generate_blob_sas(
+        blob_client.account_name,
+        blob_client.container_name,
+        blob_client.blob_name,
+        account_key=service.credential.account_key,
+        permission='r',
+        expiry=datetime.datetime.now() + datetime.timedelta(days=5),
+    )
@@ -0,0 +1,210 @@
+import collections
+import concurrent.futures
+import threading
+import logging
+import time
+import os
+import pika
+
+logger = logging.getLogger(__name__)
+
+# seconds between attempts to connect to rabbit
+RECONNECT_DELAY = 2
+
+class PublishError(RuntimeError):
+    pass
+
+class Publisher:
+    """Long lived connection to rabbit shared by all request threads. Pika
+    connections are not thread safe, so the connection lives in its own
+    thread with its ioloop, other threads only queue messages and wait for
+    their confirmation. Messages are published as they come and the broker
+    confirms them in batches (multiple acks). When the connection drops,
+    unconfirmed messages are published again after reconnect."""
+
+    def __init__(self, host, routing_key, max_pending=1000, timeout=30):
+        self._parameters = pika.ConnectionParameters(host=host)
+        self._routing_key = routing_key
+        self._max_pending = max_pending
+        self._timeout = timeout
+
+        self._lock = threading.Condition()
+        self._queued = collections.deque() # (body, future, time)
+        self._unconfirmed = {} # delivery tag -> (body, future, time)
+        self._connection = None
+        self._channel = None
+        self._tag = 0
+        self._thread = None
+        self._stopping = threading.Event()
+
+        self._stats = collections.Counter()
+        self._latency_sum = 0.0
+        self._latency_max = 0.0
+
+    @classmethod
+    def from_env(cls):
+        return cls(os.getenv('RABBIT_MQ'), os.getenv('RESULTS_QUEUE_NAME'),
+            int(os.getenv('PUBLISH_BUFFER', '1000')), float(os.getenv('PUBLISH_TIMEOUT', '30')))
+
+    def publish(self, body):
+        """Publishes body and waits until the broker confirms it, raises
+        PublishError when it is rejected or it takes too long."""
+        future = concurrent.futures.Future()
+        deadline = time.monotonic() + self._timeout
+
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='publisher', daemon=True)
+                self._thread.start()
+
+            # bounded buffer, requests wait while rabbit is unreachable
+            while len(self._queued) + len(self._unconfirmed) >= self._max_pending:
+                if not self._lock.wait(deadline - time.monotonic()):
+                    self._stats['rejected'] += 1
+                    raise PublishError('Too many messages are waiting for rabbit')
+
+            item = (body, future, time.monotonic())
+            self._queued.append(item)
+            connection = self._connection
+
+        if connection is not None:
+            try:
+                connection.ioloop.add_callback_threadsafe(self._flush)
+            except Exception:
+                pass # closing, messages are published after reconnect
+
+        try:
+            future.result(max(0, deadline - time.monotonic()))
+        except concurrent.futures.TimeoutError:
+            with self._lock:
+                if not future.done():
+                    self._expire(item)
+                    raise PublishError('Message was not confirmed in time') from None
+            future.result() # confirmed meanwhile
+
+    def stats(self):
+        with self._lock:
+            confirmed = self._stats['confirmed']
+            return dict(self._stats,
+                pending=len(self._queued) + len(self._unconfirmed),
+                latency_avg=round(self._latency_sum / confirmed, 6) if confirmed else None,
+                latency_max=round(self._latency_max, 6))
+
+    def close(self):
+        self._stopping.set()
+        with self._lock:
+            connection = self._connection
+        if connection is not None:
+            connection.ioloop.add_callback_threadsafe(lambda: self._shutdown(connection))
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+
+    def _expire(self, item):
+        # caller already failed, so the message is not published (again)
+        # later and it does not take place in the buffer, called with lock
+        try:
+            self._queued.remove(item)
+        except ValueError:
+            for tag, unconfirmed in list(self._unconfirmed.items()):
+                if unconfirmed is item:
+                    del self._unconfirmed[tag]
+        item[1].cancel()
+        self._stats['expired'] += 1
+        self._lock.notify_all()
+
+    # everything below runs in the publisher thread
+
+    def _run(self):
+        while not self._stopping.is_set():
+            connection = pika.SelectConnection(self._parameters,
+                on_open_callback=self._on_open,
+                on_open_error_callback=self._on_open_error,
+                on_close_callback=self._on_closed)
+            with self._lock:
+                self._connection = connection
+
+            connection.ioloop.start()
+
+            with self._lock:
+                self._connection = None
+                self._channel = None
+                # not confirmed, so they might be lost, publish them again
+                for tag in sorted(self._unconfirmed, reverse=True):
+                    self._queued.appendleft(self._unconfirmed.pop(tag))
+
+            if not self._stopping.is_set():
+                self._stats['reconnects'] += 1
+                self._stopping.wait(RECONNECT_DELAY)
+
+        with self._lock:
+            for _, future, _ in self._queued:
+                future.set_exception(PublishError('Publisher was closed'))
+            self._queued.clear()
+
+    def _shutdown(self, connection):
+        if connection.is_closing or connection.is_closed:
+            connection.ioloop.stop()
+        else:
+            connection.close()
+
+    def _on_open(self, connection):
+        logger.info('Connected to rabbit')
+        connection.channel(on_open_callback=self._on_channel_open)
+
+    def _on_open_error(self, connection, error):
+        logger.warning('Cannot connect to rabbit: %s', error)
+        connection.ioloop.stop()
+
+    def _on_closed(self, connection, reason):
+        if not self._stopping.is_set():
+            logger.warning('Connection to rabbit was closed: %s', reason)
+        connection.ioloop.stop()
+
+    def _on_channel_open(self, channel):
+        channel.add_on_close_callback(self._on_channel_closed)
+        channel.confirm_delivery(self._on_confirm, lambda _: self._on_confirm_mode(channel))
+
+    def _on_channel_closed(self, channel, reason):
+        if not self._stopping.is_set():
+            logger.warning('Rabbit channel was closed: %s', reason)
+        if channel.connection.is_open:
+            channel.connection.close()
+
+    def _on_confirm_mode(self, channel):
+        with self._lock:
+            self._channel = channel
+            self._tag = 0 # delivery tags are counted per channel
+        self._flush()
+
+    def _flush(self):
+        with self._lock:
+            if self._channel is None or not self._channel.is_open:
+                return
+
+            while self._queued:
+                item = self._queued.popleft()
+                # No queue declare here, we expect that queue will be
+                # declared by tester service.
+                self._channel.basic_publish(exchange='', routing_key=self._routing_key, body=item[0])
+                self._tag += 1
+                self._unconfirmed[self._tag] = item
+                self._stats['published'] += 1
+
+    def _on_confirm(self, frame):
+        method = frame.method
+        acked = isinstance(method, pika.spec.Basic.Ack)
+
+        with self._lock:
+            tags = [tag for tag in self._unconfirmed if tag == method.delivery_tag or (method.multiple and tag <= method.delivery_tag)]
+            now = time.monotonic()
+            for tag in tags:
+                _, future, start = self._unconfirmed.pop(tag)
+                if acked:
+                    self._stats['confirmed'] += 1
+                    self._latency_sum += now - start
+                    self._latency_max = max(self._latency_max, now - start)
+                    future.set_result(None)
+                else:
+                    self._stats['nacked'] += 1
+                    future.set_exception(PublishError('Message was rejected by rabbit'))
+            self._lock.notify_all()
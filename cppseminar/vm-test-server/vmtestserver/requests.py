@@ -4,69 +4,98 @@ import os
 import logging
 import http.client
 import base64
-import tempfile
 import uuid
-import contextlib
-import pika
+import threading
+import concurrent.futures
 
-from .blob import download_file, upload_file_and_get_token, AzureFileError
-
-TEMP_DIR = tempfile.mkdtemp(prefix='upload')
+from .blob import download_file, upload_and_get_token, AzureFileError
+from .publisher import Publisher
 
 logger = logging.getLogger(__name__)
 
+# one connection to rabbit shared by all request threads, it is created
+# on first use, so importing does not need the environment
+_publisher = None
+_publisher_lock = threading.Lock()
+
+def get_publisher():
+    global _publisher
+    with _publisher_lock:
+        if _publisher is None:
+            _publisher = Publisher.from_env()
+        return _publisher
+
+def close_publisher():
+    with _publisher_lock:
+        if _publisher is not None:
+            _publisher.close()
+
+# blobs of one result are uploaded at once
+_uploads = concurrent.futures.ThreadPoolExecutor(max_workers=int(os.getenv('UPLOAD_WORKERS', '12')), thread_name_prefix='upload')
+
 def _publish_to_queue(data):
     try:
-        with contextlib.closing(pika.BlockingConnection(
-            pika.ConnectionParameters(host=os.getenv('RABBIT_MQ')))) as connection:
-            channel = connection.channel()
-
-            # No queue declare here, we expect that queue will be declared by
-            # tester service.
-            channel.basic_publish(exchange='', routing_key=os.getenv('RESULTS_QUEUE_NAME'), body=json.dumps(data))
-    
+        get_publisher().publish(json.dumps(data))
     except Exception as e:
         logger.error("Encountered exception while publishing results", exc_info=e)
         raise
 
 
-def _process_results_success(data):
-    result_zip = base64.b64decode(data['data'])
-    
-    zip_file_path = os.path.join(TEMP_DIR, str(uuid.uuid4())) + '.zip'
-    students_file_path = os.path.join(TEMP_DIR, str(uuid.uuid4())) + '.zip'
-    teachers_file_path = os.path.join(TEMP_DIR, str(uuid.uuid4())) + '.zip'
+class _Base64Reader:
+    """Readable stream of base64 encoded string, only the part which is read
+    is decoded, so the decoded data are never in memory as a whole."""
 
-    try:
-        with open(zip_file_path, 'wb') as f:
-            f.write(result_zip)
+    def __init__(self, encoded):
+        if len(encoded) % 4 != 0:
+            raise ValueError('Invalid base64 data, length is not a multiple of 4')
+
+        self._encoded = encoded
+        self._position = 0
+        self._pending = b''
+        self.length = len(encoded) // 4 * 3 - encoded[-2:].count('=')
+
+    def readable(self):
+        return True
 
-        with open(students_file_path, 'w') as f:
-            json.dump(data['students'], f)
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.length
 
-        with open(teachers_file_path, 'w') as f:
-            json.dump(data['teachers'], f)
+        # every 4 characters are decoded to 3 bytes
+        needed = max(0, size - len(self._pending))
+        end = min(len(self._encoded), self._position + (needed + 2) // 3 * 4)
+        data = self._pending + base64.b64decode(self._encoded[self._position:end], validate=True)
 
+        self._position = end
+        self._pending = data[size:]
+        return data[:size]
+
+def _upload_zip(encoded, connection_string):
+    stream = _Base64Reader(encoded)
+    return upload_and_get_token(stream, str(uuid.uuid4()) + '.zip', 'vm-test-results', connection_string, stream.length)
+
+def _upload_json(value, container, connection_string):
+    return upload_and_get_token(json.dumps(value).encode('utf-8'), str(uuid.uuid4()) + '.zip', container, connection_string)
+
+def _process_results_success(data):
+    try:
         connection_string = os.getenv('RESULTS_BLOB_CONN_STR')
 
-        req = {
-            'students': upload_file_and_get_token(students_file_path, 'vm-test-students', connection_string),
-            'teachers': upload_file_and_get_token(teachers_file_path, 'vm-test-teachers', connection_string),
-            'data': upload_file_and_get_token(zip_file_path, 'vm-test-results', connection_string),
-            'metaData': data['metaData'], # forward metadata
+        uploads = {
+            'students': _uploads.submit(_upload_json, data['students'], 'vm-test-students', connection_string),
+            'teachers': _uploads.submit(_upload_json, data['teachers'], 'vm-test-teachers', connection_string),
+            'data': _uploads.submit(_upload_zip, data['data'], connection_string),
         }
 
+        req = {key: upload.result() for key, upload in uploads.items()}
+        req['metaData'] = data['metaData'] # forward metadata
+
         _publish_to_queue(req)
 
 
     except Exception as e:
         logger.error("Encountered exception while processing results", exc_info=e)
         raise
-    finally:
-        with contextlib.suppress(FileNotFoundError):
-            os.remove(zip_file_path)
-            os.remove(students_file_path)
-            os.remove(teachers_file_path)
 
 def _process_results_failure(data):
     logger.error('Test failed with error: %s', data['error'])
@@ -79,11 +108,9 @@ def _process_results_failure(data):
     if 'data' in data:
         # let's try to save the data if it's present
         # we may have some useful insights from the failed test
-        result_zip = base64.b64decode(data['data'])
-        zip_file_path = os.path.join(TEMP_DIR, str(uuid.uuid4())) + '.zip'
         connection_string = os.getenv('RESULTS_BLOB_CONN_STR')
-        
-        req['data'] = upload_file_and_get_token(zip_file_path, 'vm-test-results', connection_string)
+
+        req['data'] = _upload_zip(data['data'], connection_string)
 
     _publish_to_queue(req)
 
@@ -1,6 +1,6 @@
-from flask import Flask, request
+from flask import Flask, request, jsonify
 
-from .requests import process_test, process_results
+from .requests import process_test, process_results, get_publisher
 
 app = Flask(__name__)
 
@@ -15,3 +15,9 @@ def test():
     return '', process_test(request.data)
 
 
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    # publish latency (seconds) and reconnects of rabbit publisher
+    return jsonify(get_publisher().stats())
+
+
@@ -0,0 +1,280 @@
+# Run tester over example tests and submissions and compare it with baseline
+import sys
+import os
+import argparse
+import pathlib
+import shutil
+import statistics
+import subprocess
+import tempfile
+import fnmatch
+import json
+import time
+from typing import List, Dict, Any
+
+DESCRIPTION = """benchmark - runs python -m tester over pairs of example tests and
+submissions (the same name in tests and submissions folder) in copy and build
+mode, the same way as in docker image, and measures wall time of phases, peak
+memory and output size. It needs cmake, compiler, catch2 (use --toolchain for
+vcpkg) and user apc-test, so run it as root in the tester image or in similar
+environment. Azure, RabbitMQ or VMs are not needed."""
+
+_HERE = pathlib.Path(__file__).parent.absolute()
+
+# split the same way as in create-docker.ps1
+_SOURCES = ['*.cpp', '*.cc', '*.c', '*.h', '*.hpp']
+
+# metrics compared with baseline, phases are compared as well
+_METRICS = ['wall_time', 'max_rss_kb', 'output_bytes']
+
+
+def build_arguments():
+    parser = argparse.ArgumentParser(description=DESCRIPTION)
+    parser.add_argument(
+        "--examples",
+        type=pathlib.Path,
+        default=_HERE / "example",
+        help="Folder with tests and submissions subfolders")
+    parser.add_argument(
+        "--support",
+        type=pathlib.Path,
+        default=_HERE / "cpp-support",
+        help="Support files copied to tests (cmake project)")
+    parser.add_argument(
+        "--mode",
+        action="append",
+        choices=["copy", "build"],
+        dest="modes",
+        help="Test mode, can be given more times (default is both)")
+    parser.add_argument(
+        "--case",
+        action="append",
+        dest="cases",
+        default=list(),
+        help="Glob pattern of example names to run (default is all)")
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=3,
+        help="How many times tester runs for every example and mode")
+    parser.add_argument(
+        "--toolchain",
+        help="CMAKE_TOOLCHAIN_FILE for tests (e.g. vcpkg.cmake with catch2)")
+    parser.add_argument(
+        "--env",
+        action="append",
+        default=list(),
+        help="Additional environment variable for tester (NAME=VALUE)")
+    parser.add_argument(
+        "--output",
+        type=pathlib.Path,
+        help="Write results to this json file")
+    parser.add_argument(
+        "--baseline",
+        type=pathlib.Path,
+        help="Compare results with this json file (written by --output)")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.1,
+        help="Relative slowdown reported as regression (default is 0.1)")
+    parser.add_argument(
+        "--min-duration",
+        type=float,
+        default=0.1,
+        help="Phases shorter than this (in baseline) are too noisy to compare")
+    parser.add_argument(
+        "--keep",
+        action="store_true",
+        help="Do not remove working directories")
+    return parser
+
+
+class Workspace:
+    """Directory with the same layout as the docker image (see Dockerfile),
+    configured and prebuilt once, runs start from that state."""
+
+    def __init__(self, root: pathlib.Path, tests: pathlib.Path, submission: pathlib.Path, support: pathlib.Path, mode: str):
+        self.root = root
+        self.mode = mode
+        self.tests = root / "tests"
+        self.data = root / "data"
+        self.submission = root / "submission"
+        self.project = root / "submission-cmake"
+        self.output = root / "output"
+        self.cache = root / "cache"
+        self._prebuilt_cache = root / "cache-prebuilt"
+
+        self.root.mkdir(parents=True)
+        self.tests.mkdir()
+        self.data.mkdir()
+        for path in tests.iterdir():
+            if path.is_file():
+                is_source = any(fnmatch.fnmatch(path.name, pattern) for pattern in _SOURCES)
+                shutil.copy2(path, self.tests if is_source else self.data)
+        shutil.copytree(support, self.tests, dirs_exist_ok=True)
+        shutil.copytree(_HERE / "submission-cmake", self.project)
+        shutil.copytree(submission, self.submission)
+
+    def env(self, extra: List[str]) -> Dict[str, str]:
+        env = dict(os.environ)
+        env.update({
+            "TEST_MODE": self.mode,
+            "OUTPUT_PATH": str(self.output),
+            "SUBMISSION_PATH": str(self.submission),
+            "TESTS_PATH": str(self.tests),
+            "DATA_PATH": str(self.data),
+            "SUBMISSION_PROJECT": str(self.project),
+            "CACHE_PATH": str(self.cache),
+        })
+        env.update(item.split("=", 1) for item in extra)
+        return env
+
+    def prepare(self, toolchain: str, extra: List[str]):
+        for build_type in ["Debug", "Release"]:
+            args = ["cmake", "-B", f"./build-{build_type.lower()}", "-S", ".", f"-DCMAKE_BUILD_TYPE={build_type}"]
+            if toolchain:
+                args.append(f"-DCMAKE_TOOLCHAIN_FILE={toolchain}")
+            subprocess.run(args, cwd=self.tests, check=True, stdout=subprocess.DEVNULL)
+
+        subprocess.run([sys.executable, "-m", "tester", "--prebuild"],
+            cwd=_HERE, env=self.env(extra), check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+        # every run starts with cache as it is in a fresh container
+        if self.cache.exists():
+            shutil.copytree(self.cache, self._prebuilt_cache)
+
+    def reset(self):
+        shutil.rmtree(self.output, ignore_errors=True)
+        self.output.mkdir()
+        shutil.rmtree(self.cache, ignore_errors=True)
+        if self._prebuilt_cache.exists():
+            shutil.copytree(self._prebuilt_cache, self.cache)
+
+
+def _folder_size(path: pathlib.Path) -> int:
+    return sum(f.stat().st_size for f in path.glob("**/*") if f.is_file())
+
+
+def run_tester(workspace: Workspace, extra: List[str]) -> Dict[str, Any]:
+    """Runs tester once, returns its measurements."""
+    workspace.reset()
+
+    start = time.monotonic()
+    tester = subprocess.Popen([sys.executable, "-m", "tester"],
+        cwd=_HERE, env=workspace.env(extra), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    # wait4 gives peak memory of tester and processes it waited for
+    _, status, usage = os.wait4(tester.pid, 0)
+    wall_time = time.monotonic() - start
+
+    returncode = os.waitstatus_to_exitcode(status)
+    if returncode != 0:
+        raise RuntimeError(f"tester returned {returncode}, see {workspace.output}")
+
+    with open(workspace.output / "teachers.json") as f:
+        teachers = json.load(f)
+    if "status" in teachers:
+        raise RuntimeError(f"tester failed, see {workspace.output / 'main-tester.log'}")
+
+    with open(workspace.output / "timings.json") as f:
+        timings = json.load(f)
+
+    phases: Dict[str, float] = {}
+    for phase in timings["phases"]:
+        phases[phase["name"]] = phases.get(phase["name"], 0.0) + phase["duration"]
+
+    return {
+        "wall_time": wall_time,
+        "max_rss_kb": usage.ru_maxrss,
+        "output_bytes": _folder_size(workspace.output),
+        "phases": phases,
+    }
+
+
+def summarize(runs: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Median of all runs, it is not affected by one slow run."""
+    summary: Dict[str, Any] = {metric: statistics.median(run[metric] for run in runs) for metric in _METRICS}
+    names = sorted({name for run in runs for name in run["phases"]})
+    summary["phases"] = {name: statistics.median(run["phases"].get(name, 0.0) for run in runs) for name in names}
+    summary["runs"] = len(runs)
+    return summary
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], threshold: float, min_duration: float) -> List[str]:
+    """Returns list of regressions, everything is printed."""
+    regressions = []
+
+    def check(name, current, previous, significant=True):
+        change = (current - previous) / previous if previous else 0.0
+        regressed = significant and change > threshold
+        mark = "REGRESSION" if regressed else ""
+        print(f"  {name:50s} {previous:12.3f} {current:12.3f} {change:+8.1%} {mark}")
+        if regressed:
+            regressions.append(name)
+
+    for scenario, result in results.items():
+        if scenario not in baseline:
+            print(f"{scenario}: not in baseline")
+            continue
+
+        print(f"{scenario}:")
+        previous = baseline[scenario]
+        for metric in _METRICS:
+            check(f"{scenario} {metric}", result[metric], previous[metric])
+        for name, duration in result["phases"].items():
+            if name in previous["phases"]:
+                check(f"{scenario} {name}", duration, previous["phases"][name], previous["phases"][name] >= min_duration)
+
+    return regressions
+
+
+def main() -> int:
+    args = build_arguments().parse_args()
+    modes = args.modes or ["copy", "build"]
+
+    examples = sorted(path.name for path in (args.examples / "tests").iterdir()
+        if (args.examples / "submissions" / path.name).is_dir())
+    if args.cases:
+        examples = [name for name in examples if any(fnmatch.fnmatch(name, pattern) for pattern in args.cases)]
+
+    results: Dict[str, Any] = {}
+    root = pathlib.Path(tempfile.mkdtemp(prefix="apc-benchmark-"))
+    os.chmod(root, 0o755) # tests run as apc-test
+    try:
+        for name in examples:
+            for mode in modes:
+                scenario = f"{name}/{mode}"
+                print(f"Preparing {scenario}")
+                workspace = Workspace(root / name / mode, args.examples / "tests" / name,
+                    args.examples / "submissions" / name, args.support, mode)
+                workspace.prepare(args.toolchain, args.env)
+
+                runs = []
+                for i in range(args.repeat):
+                    runs.append(run_tester(workspace, args.env))
+                    print(f"  run {i + 1}: {runs[-1]['wall_time']:.3f}s")
+                results[scenario] = summarize(runs)
+    finally:
+        if args.keep:
+            print(f"Working directories kept in {root}")
+        else:
+            shutil.rmtree(root, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+        regressions = compare(results, baseline, args.threshold, args.min_duration)
+        if regressions:
+            print(f"{len(regressions)} regressions over {args.threshold:.0%}")
+            return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -6,116 +6,382 @@ import logging
 import os
 import shutil
 import json
+import functools
+import argparse
+import sys
+import threading
+import time
+import collections
+import concurrent.futures
 
 from tester.config import Config, SubmissionMode, Configuration
 import tester.logger
 import tester.compiler as compiler
 import tester.tests
+from tester.scheduler import Scheduler
+from tester.staging import Staging
+from tester.history import History
+from tester.job import Job
+from tester.listing import ListingCache
+from tester.results import ResultWriter
+from tester.daemon import Daemon
 
 logger = logging.getLogger(__name__)
 
-def build(project_path):
-    build_result = compiler.compile_cmake_project(project_path)
+# expected seconds of phases which have not run before
+CONFIGURE_COST = 10
+SYNTAX_COST = 5
+BUILD_COST = 60
+TESTS_COST = 60
 
-    build_output = os.path.join(Config.build_output_path(), project_path.replace('/', '_') + '.txt')
+# make targets of cpp-support which never include the submission, prebuild
+# fails when they do not compile
+SUPPORT_TARGETS = ['cmake_pch.hxx.gch', 'launch.o', 'support.o']
+
+def build(job, project_path, jobs, phase, parallel):
+    with job.timings.phase(phase, jobs=jobs) as args:
+        build_result = compiler.compile_cmake_project(project_path, jobs, phase, parallel, job.budget)
+        args['errno'] = build_result.errno
+
+    build_output = os.path.join(job.build_output_path(), project_path.replace('/', '_') + '.txt')
 
     with open(build_output, "w") as text_file:
         text_file.write(build_result.compiler_output)
 
     return build_result
 
-def build_tests():
-    # copy submission to main test file
+def copy_submission(job):
+    # do not copy metadata, the submission must be newer than anything
+    # prebuilt, otherwise make would not notice it changed
     if Config.get_mode() == SubmissionMode.COPY:
         # this is quite a hack, input file is always named main.cpp, so
         # we need to change that to header file
-        shutil.copy2(os.path.join(Config.submission_path(), 'main.cpp'), os.path.join(Config.tests_path(), 'submission.h'))
+        shutil.copyfile(os.path.join(job.submission_path, 'main.cpp'), os.path.join(Config.tests_path(), 'submission.h'))
+    else:
+        shutil.copyfile(os.path.join(job.submission_path, 'main.cpp'), os.path.join(Config.submission_project(), 'main.cpp'))
+
+def check_syntax(job):
+    """Parses translation units with the submission (release flags, they
+    have the same warnings and no sanitizers), returns CompilationResult or
+    None when the check was not done."""
+    if not Config.syntax_check():
+        job.budget.cancel('check-syntax')
+        return None
 
-    result = {}
-    for configuration in [Configuration.DEBUG, Configuration.RELEASE]:
-        result[configuration] = build(os.path.join(Config.tests_path(), f'build-{configuration}'))
+    if Config.get_mode() == SubmissionMode.COPY:
+        build_path = os.path.join(Config.tests_path(), f'build-{Configuration.RELEASE}')
+        def select(source):
+            try:
+                with open(source, errors='replace') as f:
+                    return 'submission.h' in f.read()
+            except OSError:
+                return False
+    else:
+        build_path = os.path.join(Config.submission_project(), f'build-{Configuration.RELEASE}')
+        main = os.path.realpath(os.path.join(Config.submission_project(), 'main.cpp'))
+        def select(source):
+            return os.path.realpath(source) == main
+
+    with job.timings.phase('check-syntax') as args:
+        result = compiler.check_syntax(build_path, select, 'check-syntax', job.budget)
+        args['errno'] = result.errno if result is not None else None
+
+    if result is None:
+        job.budget.cancel('check-syntax')
+    else:
+        with open(os.path.join(job.build_output_path(), 'check-syntax.txt'), 'w') as text_file:
+            text_file.write(result.compiler_output)
 
     return result
 
-def build_submission():
-    if Config.get_mode() != SubmissionMode.BUILD:
-        return {}
+def gated(job, scheduler, phases, build):
+    """Runs build unless the syntax check failed, its result is returned
+    instead then, so both configurations report it."""
+    syntax = scheduler.result('check-syntax')
+    if syntax is not None and syntax.errno != 0:
+        for phase in phases:
+            job.budget.cancel(phase)
+        return syntax
 
-    shutil.copy2(os.path.join(Config.submission_path(), 'main.cpp'), Config.submission_project())
+    return build()
 
-    result = {}
-    for configuration in [Configuration.DEBUG, Configuration.RELEASE]:
-        project_result = compiler.compile_cmake_lists(Config.submission_project(), configuration)
+def build_tests(job, configuration, jobs, parallel):
+    return build(job, os.path.join(Config.tests_path(), f'build-{configuration}'), jobs, f'build-tests/{configuration}', parallel)
 
-        build_output = os.path.join(Config.build_output_path(), Config.submission_project().replace('/', '_') + f'-{configuration}-cmake-lists.txt')
+def build_submission(job, configuration, jobs, parallel):
+    with job.timings.phase(f'configure/{configuration}') as args:
+        project_result = compiler.compile_cmake_lists(Config.submission_project(), configuration, f'configure/{configuration}', job.budget)
+        args['errno'] = project_result.errno
 
-        with open(build_output, "w") as text_file:
-            text_file.write(project_result.compiler_output)
+    build_output = os.path.join(job.build_output_path(), Config.submission_project().replace('/', '_') + f'-{configuration}-cmake-lists.txt')
 
-        if project_result.errno != 0:
-            return {}
+    with open(build_output, "w") as text_file:
+        text_file.write(project_result.compiler_output)
 
-        result[configuration] = build(project_result.output_path)
+    if project_result.errno != 0:
+        job.budget.cancel(f'build-submission/{configuration}')
+        return project_result
 
-    return result
+    return build(job, project_result.output_path, jobs, f'build-submission/{configuration}', parallel)
+
+def prepare_tests(job, scheduler, staging, configuration):
+    """Stages binaries and lists tests, returns None when tests cannot be
+    built and False when the submission cannot be built."""
+    binary = scheduler.result(f'build-tests-{configuration}')
+    if binary.errno != 0:
+        return None
+
+    submission_path = None
+    if Config.get_mode() == SubmissionMode.BUILD:
+        submission_binary = scheduler.result(f'build-submission-{configuration}')
+        if submission_binary.errno != 0:
+            return False
+
+        submission_path = submission_binary.output_path
+
+    return tester.tests.Tests(binary.output_path, configuration, staging, submission_path, job.budget, job.timings)
+
+def run_tests(job, scheduler, writer, configuration):
+    # the real cases are planned once they are listed
+    job.budget.cancel(f'tests/{configuration}')
+
+    tests = scheduler.result(f'prepare-tests-{configuration}')
+    if tests is None:
+        return None # build failed
+
+    if tests is False:
+        return {} # cannot compile submission
+
+    with job.timings.phase(f'tests/{configuration}') as args:
+        results = tests.run_tests(tests.test_cases, Config.test_workers(), functools.partial(writer.add_case, configuration))
+        args['cases'] = len(results)
+
+    job.budget.learn(f'tests/{configuration}', sum((r.resources or {}).get('wall_time', 0) for r in results.values()))
+    return results
+
+def build_and_run(job, configurations, staging, writer, trees=None):
+    """Builds all configurations at once and starts tests for each
+    configuration as soon as its binaries are linked. When trees lock is
+    given (batch mode), it is held until binaries of all configurations are
+    staged, then another submission can use the build trees."""
+    builds = len(configurations)
+    if Config.get_mode() == SubmissionMode.BUILD:
+        builds *= 2
+    jobs = Config.build_jobs(builds)
+
+    if trees is not None:
+        trees.acquire()
+        job.budget.restart() # waiting for the trees is not part of the budget
+
+    lock = threading.Lock()
+    held = trees is not None
+    staged = set()
+
+    def release_trees():
+        nonlocal held
+        with lock:
+            if not held:
+                return
+            held = False
+        trees.release()
+
+    def prepare(configuration):
+        try:
+            return prepare_tests(job, scheduler, staging, configuration)
+        finally:
+            with lock:
+                staged.add(configuration)
+                done = staged.issuperset(configurations)
+            if done:
+                release_trees()
+
+    # everything ahead is planned, so the first phases know what to leave
+    # for the others
+    job.budget.plan('check-syntax', SYNTAX_COST)
+    for configuration in configurations:
+        job.budget.plan(f'build-tests/{configuration}', BUILD_COST)
+        if Config.get_mode() == SubmissionMode.BUILD:
+            job.budget.plan(f'configure/{configuration}', CONFIGURE_COST)
+            job.budget.plan(f'build-submission/{configuration}', BUILD_COST)
+        job.budget.plan(f'tests/{configuration}', TESTS_COST)
+
+    # builds which compile the submission wait for the syntax check, in
+    # build mode tests do not depend on the submission
+    scheduler = Scheduler()
+    syntax = scheduler.add('check-syntax', functools.partial(check_syntax, job))
+    for configuration in configurations:
+        build_tests_task = functools.partial(build_tests, job, configuration, jobs, builds)
+        if Config.get_mode() == SubmissionMode.COPY:
+            build_tests_task = functools.partial(gated, job, scheduler, [f'build-tests/{configuration}'], build_tests_task)
+            depends = [scheduler.add(f'build-tests-{configuration}', build_tests_task, [syntax])]
+        else:
+            build_submission_task = functools.partial(gated, job, scheduler, [f'configure/{configuration}', f'build-submission/{configuration}'],
+                functools.partial(build_submission, job, configuration, jobs, builds))
+            depends = [
+                scheduler.add(f'build-tests-{configuration}', build_tests_task),
+                scheduler.add(f'build-submission-{configuration}', build_submission_task, [syntax]),
+            ]
+
+        prepared = scheduler.add(f'prepare-tests-{configuration}', functools.partial(prepare, configuration), depends)
+        scheduler.add(f'run-tests-{configuration}', functools.partial(run_tests, job, scheduler, writer, configuration), [prepared])
+
+    try:
+        with job.timings.phase('copy_submission'):
+            copy_submission(job)
+
+        scheduler.run()
+    finally:
+        release_trees()
+
+    # keep the order of configurations, tasks may finish in any order
+    binaries = { 'tests': {c: scheduler.result(f'build-tests-{c}') for c in configurations} }
+    if Config.get_mode() == SubmissionMode.BUILD:
+        binaries['submission'] = {c: scheduler.result(f'build-submission-{c}') for c in configurations}
+
+    test_results = {}
+    for configuration in configurations:
+        result = scheduler.result(f'run-tests-{configuration}')
+        if result is not None:
+            test_results[configuration] = result
 
-def create_success_output(binaries, tests_result):
-    logger.debug('Creating json with tests results')
-
-    teachers = {
-        'compilation': [{
-            'binary': binary,
-            'configurations': [{
-                'name': name,
-                'result': result.__dict__
-            } for name, result in configurations.items()]
-        } for binary, configurations in binaries.items()],
-        'tests': [{
-            'configuration': configuration,
-            'cases': [{
-                'name': name,
-                'result': dict(status=result.get_status(), **result.__dict__)
-            } for name, result in cases.items()]
-        } for configuration, cases in tests_result.items()]
-    }
-
-    with open(Config.teachers_json(), 'w') as f:
-        json.dump(teachers, f, indent=2)
-
-    def test_result_students(result):
-        # do not propagate this verbose status
-        status = result.get_status()
-        if status != tester.tests.TestResultStatus.SUCCESS:
-            status = tester.tests.TestResultStatus.FAILED
-
-        result = dict(status=status, **result.__dict__)
-
-        filtered_items = ['status']
-        if Config.show_results_to_students():
-            filtered_items.append('stdout')
-            filtered_items.append('returncode')
-
-        return {key: value for key, value in result.items() if key in filtered_items}
-
-    students = {
-        'compilation': [{
-            'binary': binary,
-            'configurations': [{
-                'name': name,
-                'result': {key: value for key, value in result.__dict__.items() if key in ['errno', 'compiler_output']}
-            } for name, result in configurations.items()]
-        } for binary, configurations in binaries.items()],
-        'tests': [{
-            'configuration': configuration,
-            'cases': [{
-                'name': name,
-                'result': test_result_students(result)
-            } for name, result in cases.items()]
-        } for configuration, cases in tests_result.items()]
-    }
-
-    with open(Config.students_json(), 'w') as f:
-        json.dump(students, f, indent=2)
+    return binaries, test_results
+
+def prebuild():
+    """
+    Called when the image is built. Compiles everything what does not
+    depend on the submission, so the runtime build only compiles objects
+    including the submission and links.
+    """
+    compiler.check_cmake()
+
+    configurations = [Configuration.DEBUG, Configuration.RELEASE]
+    jobs = Config.build_jobs(1)
+    for configuration in configurations:
+        build_path = os.path.join(Config.tests_path(), f'build-{configuration}')
+        result = compiler.prebuild_cmake_project(build_path, jobs)
+        logger.debug('Prebuild output:\n%s', result.compiler_output)
+
+        if result.errno == 0:
+            # tests do not depend on the submission (build mode), the listing
+            # will be the same for every run
+            tester.tests.list_tests(result.output_path, configuration, ListingCache.default())
+        elif Config.get_mode() == SubmissionMode.BUILD:
+            raise RuntimeError(f'Cannot prebuild tests:\n{result.compiler_output}')
+        else:
+            # errors are expected in objects including the submission only
+            support = compiler.build_cmake_targets(build_path, SUPPORT_TARGETS, jobs)
+            if support.errno != 0:
+                raise RuntimeError(f'Cannot prebuild support code:\n{support.compiler_output}')
+
+    if Config.get_mode() == SubmissionMode.BUILD:
+        # configuration needs the source to exist, it is replaced by the
+        # submission later, so it does not matter what is inside
+        placeholder = os.path.join(Config.submission_project(), 'main.cpp')
+        with open(placeholder, 'w') as f:
+            f.write('int main() {}\n')
+
+        try:
+            for configuration in configurations:
+                result = compiler.compile_cmake_lists(Config.submission_project(), configuration)
+                if result.errno != 0:
+                    raise RuntimeError(f'Cannot configure submission project:\n{result.compiler_output}')
+        finally:
+            os.remove(placeholder)
+
+    logger.info('Prebuild finished.')
+
+def grade(job, trees=None):
+    """Builds and tests one submission and writes its results."""
+    staging = Staging()
+    writer = ResultWriter(job)
+    try:
+        try:
+            binaries, test_results = build_and_run(job, [Configuration.DEBUG, Configuration.RELEASE], staging, writer, trees)
+        finally:
+            with job.timings.phase('cleanup'):
+                staging.cleanup()
+
+        with job.timings.phase('write_results'):
+            writer.write(binaries, test_results, staging)
+    finally:
+        writer.cleanup()
+
+    job.timings.dump(job.timings_json())
+    if Config.trace():
+        job.timings.dump_trace(job.trace_json())
+
+    return binaries, test_results
+
+def load_batch(path):
+    """Returns list of (name, submission folder). Path is a folder with
+    submission folders (containing main.cpp) or a json manifest, list of
+    objects with name and path (relative to the manifest)."""
+    if os.path.isdir(path):
+        submissions = [(name, os.path.join(path, name)) for name in sorted(os.listdir(path))
+            if os.path.isfile(os.path.join(path, name, 'main.cpp'))]
+    else:
+        with open(path) as f:
+            manifest = json.load(f)
+        submissions = [(item['name'], os.path.join(os.path.dirname(path), item['path'])) for item in manifest]
+
+    names = set()
+    for name, _ in submissions:
+        # name is used as output folder
+        if not name or name in names or os.path.basename(name) != name or name in ('.', '..'):
+            raise ValueError(f'Invalid or duplicate submission name "{name}"')
+        names.add(name)
+
+    return submissions
+
+def grade_batch(path):
+    """Grades many submissions with the same tests, build trees stay warm
+    between them. Every submission gets its own folder in the output, the
+    summary of all of them is in summary.json."""
+    submissions = load_batch(path)
+    logger.info('Grading %d submissions in batch', len(submissions))
+
+    history = History.for_tests(Config.cache_path(), Config.tests_path())
+    trees = threading.Lock()
+
+    def run(name, submission_path):
+        job = Job(name, submission_path, os.path.join(Config.output_path(), name))
+        job.budget.use_history(history)
+        start = time.monotonic()
+
+        summary = {'name': name, 'status': 'Graded'}
+        try:
+            binaries, test_results = grade(job, trees)
+            summary['compilation'] = {binary: {str(c): result.errno for c, result in configurations.items()}
+                for binary, configurations in binaries.items()}
+            summary['tests'] = {str(c): collections.Counter(result.get_status().value for result in cases.values())
+                for c, cases in test_results.items()}
+        except Exception:
+            logger.exception('Grading of submission "%s" failed', name)
+            tester.logger.write_exception(job.teachers_json(), job.students_json())
+            summary['status'] = 'Exception'
+
+        summary['duration'] = round(time.monotonic() - start, 3)
+        logger.info('Submission "%s" graded in %.1fs', name, summary['duration'])
+        return summary
+
+    start = time.monotonic()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=Config.batch_workers()) as executor:
+        summaries = list(executor.map(lambda submission: run(*submission), submissions))
+
+    history.save()
+
+    with open(os.path.join(Config.output_path(), 'summary.json'), 'w') as f:
+        json.dump({
+            'submissions': summaries,
+            'duration': round(time.monotonic() - start, 3),
+        }, f, indent=2)
+
+def parse_args():
+    parser = argparse.ArgumentParser(prog='tester', description='Builds submission, runs tests and collects results.')
+    parser.add_argument('--prebuild', action='store_true', help='compile everything that does not depend on submission (used when image is built)')
+    parser.add_argument('--batch', metavar='PATH', help='grade all submissions from folder or json manifest, results are written to subfolders of output')
+    parser.add_argument('--daemon', action='store_true', help='keep running and grade submissions sent over http (see DAEMON_ADDRESS, DAEMON_SOCKET)')
+    return parser.parse_args()
 
 def main():
     """
@@ -123,38 +389,42 @@ def main():
     load settings, compile sources, run tests and collect results,
     then it will pack those and send everything to output folder.
     """
+    args = parse_args()
+
     # start logger
     tester.logger.configure()
+
+    if args.prebuild:
+        # errors must fail the image build, do not write them as results
+        sys.excepthook = sys.__excepthook__
+        logger.info('Tester prebuild started...')
+        prebuild()
+        return
+
     logger.info('Tester started...')
     logger.debug(Config.dumps())
 
-    compiler.check_cmake()
+    job = Job.single()
 
-    test_results = {}
+    with job.timings.phase('check_cmake'):
+        compiler.check_cmake()
 
-    binaries = { 'tests': build_tests() }
+    if args.batch:
+        grade_batch(args.batch)
+        logger.info('Finished.')
+        return
 
-    if Config.get_mode() == SubmissionMode.BUILD:
-        binaries['submission'] = build_submission()
-
-    for configuration, binary in binaries['tests'].items():
-        if binary.errno != 0:
-            continue # build failed
-
-        test_results[configuration] = {}
-        tests = tester.tests.Tests(binary.output_path, configuration)
-        for test_case in tests.test_cases:
-            submission_binary = binaries.get('submission', {}).get(configuration, None)
-            if submission_binary:
-                if submission_binary.errno != 0:
-                    continue # cannot compile submission
-
-                test_result = tests.run_test(test_case, submission_binary.output_path)
-            else:
-                test_result = tests.run_test(test_case)
-            test_results[configuration][test_case] = test_result
-
-    create_success_output(binaries, test_results)
+    if args.daemon:
+        # errors of jobs are reported to clients, the rest should stop us
+        sys.excepthook = sys.__excepthook__
+        Daemon(grade, History.for_tests(Config.cache_path(), Config.tests_path())).serve()
+        return
+
+    job.budget.use_history(History.for_tests(Config.cache_path(), Config.tests_path()))
+    try:
+        grade(job)
+    finally:
+        job.budget.history.save()
 
     logger.info('Finished.')
 
@@ -3,8 +3,15 @@ import logging
 import subprocess
 import os
 import errno
+import tempfile
+import collections
+import shutil
+import shlex
+import json
+import time
 
-from tester.timeout import TimeoutManager
+from tester.timeout import budget
+from tester.config import Config
 
 logger = logging.getLogger(__name__)
 
@@ -33,44 +40,244 @@ def check_cmake():
         logger.critical('cmake cannot print version in less than 5 seconds!')
         raise
 
-def compile_cmake_project(folder):
-    logger.info('Attempting to run cmake --build on folder %s', folder)
+class CompilerCache:
+    """Environment for ccache, which is set as compiler launcher in our cmake
+    projects (if found). Cache is content addressed, it is keyed by source
+    (or preprocessed source) with all flags and compiler binary, so it can be
+    shared between containers by mounting CACHE_PATH. Every build gets its
+    own stats log, so we can report hits and misses of concurrent builds."""
+
+    def __init__(self):
+        self.path = Config.compiler_cache_path()
+        self._stats_log = None
+
+    def __enter__(self):
+        self.env = env = dict(os.environ)
+        if self.path is None:
+            env['CCACHE_DISABLE'] = '1'
+            return self
+
+        fd, self._stats_log = tempfile.mkstemp(prefix='ccache-stats', suffix='.log')
+        os.close(fd)
+
+        env['CCACHE_DIR'] = self.path
+        env['CCACHE_STATSLOG'] = self._stats_log
+        # compiler is part of the key, not just its mtime, images may differ
+        env['CCACHE_COMPILERCHECK'] = 'content'
+        # we copy the submission right before the build, and it must be able
+        # to use precompiled headers
+        env['CCACHE_SLOPPINESS'] = 'include_file_mtime,include_file_ctime,pch_defines,time_macros'
+        return self
+
+    def __exit__(self, type, value, traceback):
+        del type, value, traceback # unused
+        if self._stats_log is not None:
+            os.remove(self._stats_log)
+
+    def stats(self):
+        """Returns counter of hits and misses from the build, or None if the
+        cache is not used."""
+        if self._stats_log is None:
+            return None
+
+        with open(self._stats_log) as f:
+            results = collections.Counter(line.strip() for line in f if not line.startswith('#'))
+
+        return collections.Counter(
+            hits=results['direct_cache_hit'] + results['preprocessed_cache_hit'],
+            misses=results['cache_miss'])
+
+def compile_cmake_project(folder, jobs=2, phase=None, parallel=1, budget=budget):
+    logger.info('Attempting to run cmake --build on folder %s with %d jobs', folder, jobs)
 
     try:
-        with TimeoutManager() as timeout:
-            cmake = subprocess.run(['cmake', '--build', folder, '-j', '2'], stdout=subprocess.PIPE, stderr=subprocess.STDOUT, timeout=timeout)
+        with budget.grant(phase or folder, parallel=parallel) as grant, CompilerCache() as cache:
+            try:
+                cmake = subprocess.run(['cmake', '--build', folder, '-j', str(jobs)], stdout=subprocess.PIPE, stderr=subprocess.STDOUT, timeout=grant.timeout, env=cache.env)
+            except subprocess.TimeoutExpired:
+                grant.expire()
+                raise
+
+            stdout = cmake.stdout.decode('utf-8')
+            output = stdout
+
+            stats = cache.stats()
+            if stats is not None:
+                logger.info('Compiler cache %d hits, %d misses', stats['hits'], stats['misses'])
+                output += f'-- Compiler cache: {stats["hits"]} hits, {stats["misses"]} misses\n'
 
             if cmake.returncode != 0:
                 logger.warn('Cannot compile files, check out logs at output')
-                return CompilationResult(cmake.returncode, '', cmake.stdout.decode('utf-8'))
+                return CompilationResult(cmake.returncode, '', output)
             else:
                 logger.info('Project successfuly compiled and linked')
-                stdout = cmake.stdout.decode('utf-8')
                 # this is not pretty, but the last line of cmake is the binary,
                 # so we will use that in case everything went OK
                 binary = os.path.join(folder, stdout.split()[-1])
-                return CompilationResult(cmake.returncode, binary, stdout)
+                return CompilationResult(cmake.returncode, binary, output)
 
 
     except subprocess.TimeoutExpired:
         logger.fatal('cmake cannot compile/link files in less than timeout provided by docker!')
         return CompilationResult(errno.ETIME, '', 'cmake reach timeout.')
 
-def compile_cmake_lists(folder, configuration):
-    logger.info('Attempting to run cmake on folder %s', folder)
+def _syntax_only(command):
+    """Arguments of compile command from compile_commands.json, which only
+    parse the source, nothing is written."""
+    args = command['arguments'] if 'arguments' in command else shlex.split(command['command'])
+
+    result, skip = [], False
+    for arg in args:
+        if skip:
+            skip = False
+        elif arg in ('-o', '-MF', '-MT', '-MQ'):
+            skip = True # and its value
+        elif arg not in ('-MD', '-MMD'):
+            result.append(arg)
+
+    return [*result, '-fsyntax-only']
+
+def check_syntax(build_path, select, phase=None, budget=budget):
+    """Parses translation units of project configured in build_path, which
+    select (called with source path) picks, with the same flags they are
+    built with (compile_commands.json). Returns CompilationResult, or None
+    when the check could not be done, the full build decides then."""
+    try:
+        with open(os.path.join(build_path, 'compile_commands.json')) as f:
+            commands = [command for command in json.load(f) if select(command['file'])]
+    except (OSError, ValueError, KeyError) as e:
+        logger.info('Cannot check syntax in %s: %s', build_path, e)
+        return None
+
+    if not commands:
+        logger.info('No sources to check syntax of in %s', build_path)
+        return None
+
+    # the check has its own time, its share could be too short for heavy
+    # templates, and it must not take the time of the builds
+    output = ''
+    syntax_timeout = Config.syntax_timeout()
+    with budget.grant(phase or f'check-syntax:{build_path}', cap=syntax_timeout, floor=syntax_timeout) as grant:
+        deadline = time.monotonic() + grant.timeout
+        for command in commands:
+            logger.info('Checking syntax of %s', command['file'])
+            try:
+                check = subprocess.run(_syntax_only(command), stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                    timeout=max(0, deadline - time.monotonic()), cwd=command['directory'])
+            except subprocess.TimeoutExpired:
+                grant.expire()
+                logger.warning('Syntax check did not finish in time, the build decides')
+                return None
+
+            output += check.stdout.decode('utf-8', errors='replace')
+            if check.returncode < 0:
+                # compiler was killed (out of memory), not a syntax error
+                logger.warning('Syntax check was killed by signal %d, the build decides', -check.returncode)
+                return None
+            if check.returncode != 0:
+                logger.info('Syntax check of %s failed', command['file'])
+                return CompilationResult(check.returncode, '', output)
+
+    return CompilationResult(0, '', output)
 
+def prebuild_cmake_project(folder, jobs):
+    """Builds everything that can be built without the submission, make is
+    told to keep going, so objects that include the submission fail, but
+    all the others (and precompiled headers) are built. There is no timeout,
+    this is called when the image is built."""
+    logger.info('Attempting to prebuild folder %s with %d jobs', folder, jobs)
+
+    with CompilerCache() as cache:
+        cmake = subprocess.run(['cmake', '--build', folder, '-j', str(jobs), '--', '-k'], stdout=subprocess.PIPE, stderr=subprocess.STDOUT, env=cache.env)
+
+        stdout = cmake.stdout.decode('utf-8')
+        if cmake.returncode != 0:
+            logger.info('Project was built only partially (this is expected in copy mode)')
+            return CompilationResult(cmake.returncode, '', stdout)
+
+        logger.info('Project successfuly prebuilt')
+        return CompilationResult(cmake.returncode, os.path.join(folder, stdout.split()[-1]), stdout)
+
+def build_cmake_targets(folder, targets, jobs):
+    """Builds only given targets of configured project (object files, pch),
+    without keep going, so any error is reported. There is no timeout,
+    this is called when the image is built."""
+    logger.info('Building targets %s in folder %s', ' '.join(targets), folder)
+
+    with CompilerCache() as cache:
+        cmake = subprocess.run(['cmake', '--build', folder, '-j', str(jobs), '--target', *targets], stdout=subprocess.PIPE, stderr=subprocess.STDOUT, env=cache.env)
+
+    return CompilationResult(cmake.returncode, '', cmake.stdout.decode('utf-8', errors='replace'))
+
+def _read_cmake_cache(build_path):
+    entries = {}
+    with open(os.path.join(build_path, 'CMakeCache.txt')) as f:
+        for line in f:
+            # lines look like NAME:TYPE=VALUE
+            if line.startswith(('#', '//')) or '=' not in line:
+                continue
+            key, value = line.rstrip('\n').split('=', 1)
+            entries[key.split(':', 1)[0]] = value
+    return entries
+
+def _check_cmake_cache(folder, build_path, configuration):
+    """Returns the reason why configured project in build_path cannot be
+    used, or None when it is still valid."""
     try:
-        with TimeoutManager() as timeout:
-            build_folder = f'./build-{configuration}'
+        cache = _read_cmake_cache(build_path)
+    except OSError:
+        return 'project is not configured'
+
+    if not os.path.exists(os.path.join(build_path, 'Makefile')):
+        return 'makefile is missing'
 
-            cmake = subprocess.run(['cmake', '-B', build_folder, '-S', '.', f'-DCMAKE_BUILD_TYPE={configuration}'], stdout=subprocess.PIPE, stderr=subprocess.STDOUT, timeout=timeout, cwd=folder)
+    if os.path.realpath(cache.get('CMAKE_HOME_DIRECTORY', '')) != os.path.realpath(folder):
+        return 'project was configured from different directory'
+
+    if cache.get('CMAKE_BUILD_TYPE') != str(configuration):
+        return 'project was configured with different build type'
+
+    for tool in ['CMAKE_COMMAND', 'CMAKE_CXX_COMPILER']:
+        if not os.path.exists(cache.get(tool, '')):
+            return f'{tool} does not exist anymore'
+
+    if os.path.getmtime(os.path.join(folder, 'CMakeLists.txt')) > os.path.getmtime(os.path.join(build_path, 'CMakeCache.txt')):
+        return 'CMakeLists.txt changed'
+
+    return None
+
+def compile_cmake_lists(folder, configuration, phase=None, budget=budget):
+    """Configures project in folder, configuration created when the image
+    was built is reused if it is still valid."""
+    build_folder = f'./build-{configuration}'
+    build_path = os.path.join(folder, build_folder)
+    phase = phase or f'configure:{build_path}'
+
+    reason = _check_cmake_cache(folder, build_path, configuration)
+    if reason is None:
+        logger.info('Using cached configuration in folder %s', build_path)
+        budget.cancel(phase)
+        return CompilationResult(0, build_path, f'-- Using configuration cached in {build_path}\n')
+
+    logger.info('Attempting to run cmake on folder %s (%s)', folder, reason)
+
+    # cmake refuses to reuse cache created for another directory
+    shutil.rmtree(build_path, ignore_errors=True)
+
+    try:
+        with budget.grant(phase) as grant:
+            try:
+                cmake = subprocess.run(['cmake', '-B', build_folder, '-S', '.', f'-DCMAKE_BUILD_TYPE={configuration}'], stdout=subprocess.PIPE, stderr=subprocess.STDOUT, timeout=grant.timeout, cwd=folder)
+            except subprocess.TimeoutExpired:
+                grant.expire()
+                raise
 
             if cmake.returncode != 0:
                 logger.warn('Cannot create make files')
                 return CompilationResult(cmake.returncode, '', cmake.stdout.decode('utf-8'))
             else:
                 logger.info('Make files successfully created')
-                return CompilationResult(cmake.returncode, os.path.join(folder, build_folder), cmake.stdout.decode('utf-8'))
+                return CompilationResult(cmake.returncode, build_path, cmake.stdout.decode('utf-8'))
 
 
 
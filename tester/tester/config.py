@@ -1,6 +1,7 @@
 import pprint
 import os
 import enum
+import math
 
 
 class SubmissionMode(enum.Enum):
@@ -59,6 +60,35 @@ class Config:
     def data_path(cls):
         return os.getenv('DATA_PATH')
 
+    @classmethod
+    def cache_path(cls):
+        # directory shared between runs (can be mounted), None when not set
+        dir = os.getenv('CACHE_PATH', '')
+        if not dir:
+            return None
+
+        os.makedirs(dir, exist_ok=True)
+        return dir
+
+    @classmethod
+    def compiler_cache_path(cls):
+        if cls.cache_path() is None or os.getenv('COMPILER_CACHE', '1') != '1':
+            return None
+
+        return os.path.join(cls.cache_path(), 'ccache')
+
+    @classmethod
+    def syntax_check(cls):
+        # sources with the submission are parsed before anything is built,
+        # when that fails nothing is built
+        return os.getenv('SYNTAX_CHECK', '1') == '1'
+
+    @classmethod
+    def syntax_timeout(cls):
+        # seconds the syntax check gets (when that much is left), when it
+        # does not finish the submission is built as without the check
+        return float(os.getenv('SYNTAX_TIMEOUT', '30'))
+
     @classmethod
     def teachers_json(cls):
         return os.path.join(cls.output_path(), 'teachers.json')
@@ -67,6 +97,197 @@ class Config:
     def students_json(cls):
         return os.path.join(cls.output_path(), 'students.json')
 
+    @classmethod
+    def result_format(cls):
+        # pretty (indented) or compact json
+        return os.getenv('RESULT_FORMAT', 'pretty')
+
+    @classmethod
+    def result_compression(cls):
+        # empty, gzip or zstd (when zstandard is installed), compressed
+        # results have .gz or .zst suffix
+        return os.getenv('RESULT_COMPRESSION', '')
+
+    @classmethod
+    def result_field_limit(cls):
+        # longest output (stdout, stderr, compiler output) in results, 0
+        # means no limit besides OUTPUT_HEAD_LIMIT and OUTPUT_TAIL_LIMIT
+        return int(os.getenv('RESULT_FIELD_LIMIT', '0'))
+
+    @classmethod
+    def trace(cls):
+        # chrome trace of phases is written next to timings
+        return os.getenv('TRACE', '0') == '1'
+
+    @classmethod
+    def cpu_count(cls):
+        # os.cpu_count reports the host, docker limits us with affinity
+        # (--cpuset-cpus) or with cfs quota (--cpus), respect both
+        count = len(os.sched_getaffinity(0))
+
+        try:
+            with open('/sys/fs/cgroup/cpu.max') as f:
+                quota, period = f.read().split()
+            if quota != 'max':
+                count = min(count, max(1, int(int(quota) / int(period))))
+        except (OSError, ValueError):
+            pass
+
+        return count
+
+    @classmethod
+    def test_workers(cls):
+        workers = int(os.getenv('TEST_WORKERS', '0'))
+        return workers if workers > 0 else cls.cpu_count()
+
+    @classmethod
+    def batch_workers(cls):
+        # submissions graded at once in batch mode, builds use the same
+        # trees, so they take turns, tests of one submission run while the
+        # next one is built
+        return max(1, int(os.getenv('BATCH_WORKERS', '2')))
+
+    @classmethod
+    def daemon_socket(cls):
+        # unix socket of daemon, loopback http is used when empty
+        return os.getenv('DAEMON_SOCKET', '')
+
+    @classmethod
+    def daemon_address(cls):
+        host, port = os.getenv('DAEMON_ADDRESS', '127.0.0.1:8080').rsplit(':', 1)
+        return host, int(port)
+
+    @classmethod
+    def daemon_jobs(cls):
+        # jobs graded at once, the others are rejected
+        return max(1, int(os.getenv('DAEMON_JOBS', str(cls.batch_workers()))))
+
+    @classmethod
+    def daemon_max_upload(cls):
+        return int(os.getenv('DAEMON_MAX_UPLOAD', str(16 * 1024 * 1024)))
+
+    @classmethod
+    def daemon_max_extracted(cls):
+        # uncompressed size of all files in zip submission
+        return int(os.getenv('DAEMON_MAX_EXTRACTED', str(64 * 1024 * 1024)))
+
+    @classmethod
+    def batch_tests(cls):
+        return os.getenv('TEST_BATCH', '0') == '1'
+
+    @classmethod
+    def test_order(cls):
+        # listed (as --list-tests returns them) or history (cheap cases
+        # which often fail first)
+        return os.getenv('TEST_ORDER', 'listed')
+
+    @classmethod
+    def fail_fast(cls):
+        # crashes in configuration after which the rest is skipped, 0 never
+        return int(os.getenv('FAIL_FAST', '0'))
+
+    @classmethod
+    def bench_tag(cls):
+        # release test cases with this tag are benchmarked, empty disables it
+        return os.getenv('BENCH_TAG', '[benchmark]')
+
+    @classmethod
+    def bench_warmup(cls):
+        return int(os.getenv('BENCH_WARMUP', '1'))
+
+    @classmethod
+    def bench_runs(cls):
+        return max(1, int(os.getenv('BENCH_RUNS', '5')))
+
+    @classmethod
+    def bench_thresholds(cls):
+        # reference durations of benchmarks declared in the tests image
+        return os.getenv('BENCH_THRESHOLDS', os.path.join(cls.tests_path() or '', 'benchmark.json'))
+
+    @classmethod
+    def output_limits(cls):
+        # how many bytes from the beginning and from the end of test
+        # stdout/stderr are kept, the rest is dropped
+        head = int(os.getenv('OUTPUT_HEAD_LIMIT', str(256 * 1024)))
+        tail = int(os.getenv('OUTPUT_TAIL_LIMIT', str(256 * 1024)))
+        return head, tail
+
+    @classmethod
+    def signature_grace(cls):
+        # seconds the test may run after it reported sanitizer or debug
+        # container error, so the report is complete
+        return float(os.getenv('SIGNATURE_GRACE', '1'))
+
+    @classmethod
+    def idle_timeout(cls):
+        # seconds a test may run without using any cpu before it is stopped
+        # as deadlocked, 0 disables the watchdog, it must be longer than
+        # any wait in tests (example tests wait for output up to 30 s)
+        return float(os.getenv('IDLE_TIMEOUT', '40'))
+
+    @classmethod
+    def timeout(cls):
+        # the whole run, docker kills us after that
+        return float(os.getenv('TIMEOUT', '500'))
+
+    @classmethod
+    def output_reserve(cls):
+        # seconds kept for writing results, it should be very generous
+        return float(os.getenv('OUTPUT_RESERVE', '15'))
+
+    @classmethod
+    def grant_floor(cls):
+        # seconds of the budget kept for every phase or test case still
+        # ahead, the running one may use everything else
+        return float(os.getenv('GRANT_FLOOR', '1'))
+
+    @classmethod
+    def test_timeout_cap(cls):
+        # longest time one test case can get, None when not limited
+        cap = os.getenv('TEST_TIMEOUT_CAP', '')
+        if cap:
+            return float(cap) if float(cap) > 0 else None
+
+        return 180.0 if cls.get_mode() == SubmissionMode.COPY else None
+
+    @classmethod
+    def test_cost(cls):
+        # expected seconds of test case that has not run before, it only
+        # orders cases, it is not their timeout
+        return float(os.getenv('TEST_COST', '5'))
+
+    @classmethod
+    def cgroup_path(cls):
+        # delegated cgroup v2 hierarchy for sandboxed tests, None forces
+        # rlimits (TEST_CGROUP=0)
+        if os.getenv('TEST_CGROUP', '1') != '1':
+            return None
+        return os.getenv('CGROUP_PATH', '/sys/fs/cgroup')
+
+    @classmethod
+    def test_limits(cls):
+        # limits of one test process tree, tests are sandboxed only when
+        # some of them is set, memory in bytes (K, M, G suffixes), cpu in cpus
+        def size(value):
+            units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+            if value and value[-1].upper() in units:
+                return int(float(value[:-1]) * units[value[-1].upper()])
+            return int(value) if value else None
+
+        cpu = os.getenv('TEST_CPU_LIMIT', '')
+        pids = os.getenv('TEST_PIDS_LIMIT', '')
+        return {
+            'memory': size(os.getenv('TEST_MEMORY_LIMIT', '')),
+            'cpu': float(cpu) if cpu else None,
+            'pids': int(pids) if pids else None,
+        }
+
+    @classmethod
+    def build_jobs(cls, builds):
+        # builds run at the same time, split cpus between them, slight
+        # oversubscription is fine, some time is always spent in waiting for io
+        return max(1, math.ceil(cls.cpu_count() / max(1, builds)))
+
     @classmethod
     def get_mode(cls):
         mode = os.getenv('TEST_MODE', '')
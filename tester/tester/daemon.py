@@ -0,0 +1,188 @@
+import logging
+import http.server
+import socketserver
+import threading
+import tempfile
+import zipfile
+import shutil
+import json
+import io
+import os
+
+from tester.config import Config
+from tester.job import Job
+import tester.logger
+
+logger = logging.getLogger(__name__)
+
+class SubmissionError(ValueError):
+    pass
+
+class _UnixHTTPServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def server_bind(self):
+        # socket left by previous daemon
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+        super().server_bind()
+        os.chmod(self.server_address, 0o660)
+
+
+class _ThreadingHTTPServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+
+class Daemon:
+    """Grades submissions sent over http (loopback or unix socket) in one
+    long running process, build trees stay warm between jobs.
+
+        POST /jobs    submission (zip, or main.cpp itself), returns zip with results
+        GET  /health  daemon is running, with some statistics
+        GET  /ready   daemon can accept another job (503 when it is full)
+    """
+
+    def __init__(self, grade, history):
+        self._grade = grade
+        self._history = history
+        self._trees = threading.Lock()
+        self._slots = threading.BoundedSemaphore(Config.daemon_jobs())
+        self._lock = threading.Lock()
+        self._stats = {'running': 0, 'finished': 0, 'failed': 0, 'rejected': 0}
+        self._next_id = 0
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, limit=Config.daemon_jobs())
+
+    def _count(self, key, change=1):
+        with self._lock:
+            self._stats[key] += change
+
+    def run_job(self, body, is_zip):
+        """Grades submission in body, returns zip with the output folder or
+        None when the daemon is full. Raises SubmissionError (or BadZipFile)
+        when submission cannot be extracted."""
+        if not self._slots.acquire(blocking=False):
+            self._count('rejected')
+            return None
+
+        self._count('running')
+        with self._lock:
+            self._next_id += 1
+            name = f'job-{self._next_id}'
+
+        root = tempfile.mkdtemp(prefix='apc-job-')
+        try:
+            submission_path = os.path.join(root, 'submission')
+            os.mkdir(submission_path)
+            if is_zip:
+                with zipfile.ZipFile(io.BytesIO(body)) as archive:
+                    # sizes in the archive are checked, zipfile does not
+                    # extract more than that
+                    size = sum(info.file_size for info in archive.infolist())
+                    if size > Config.daemon_max_extracted():
+                        raise SubmissionError(f'extracted submission must have at most {Config.daemon_max_extracted()} bytes')
+                    archive.extractall(submission_path)
+            else:
+                with open(os.path.join(submission_path, 'main.cpp'), 'wb') as f:
+                    f.write(body)
+
+            job = Job(name, submission_path, os.path.join(root, 'output'))
+            job.budget.use_history(self._history)
+
+            logger.info('Grading %s', name)
+            try:
+                self._grade(job, self._trees)
+                self._count('finished')
+            except Exception:
+                logger.exception('Grading of %s failed', name)
+                tester.logger.write_exception(job.teachers_json(), job.students_json())
+                self._count('failed')
+
+            self._history.save()
+            return self._archive(job.output_path)
+        finally:
+            shutil.rmtree(root, ignore_errors=True)
+            self._count('running', -1)
+            self._slots.release()
+
+    @staticmethod
+    def _archive(path):
+        data = io.BytesIO()
+        with zipfile.ZipFile(data, 'w', zipfile.ZIP_DEFLATED) as archive:
+            for root, _, files in os.walk(path):
+                for name in files:
+                    file = os.path.join(root, name)
+                    archive.write(file, os.path.relpath(file, path))
+        return data.getvalue()
+
+    def _handler(self):
+        daemon = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                logger.debug('%s', format % args)
+
+            def _send(self, code, body, content_type='application/json'):
+                if not isinstance(body, bytes):
+                    body = json.dumps(body).encode()
+                self.send_response(code)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                if self.path == '/health':
+                    self._send(200, dict(status='ok', **daemon.stats()))
+                elif self.path == '/ready':
+                    stats = daemon.stats()
+                    ready = stats['running'] < stats['limit']
+                    self._send(200 if ready else 503, dict(ready=ready, **stats))
+                else:
+                    self._send(404, {'error': 'not found'})
+
+            def do_POST(self):
+                if self.path != '/jobs':
+                    self._send(404, {'error': 'not found'})
+                    return
+
+                length = int(self.headers.get('Content-Length', '0'))
+                if length <= 0 or length > Config.daemon_max_upload():
+                    self.close_connection = True
+                    self._send(413, {'error': f'submission must have 1 to {Config.daemon_max_upload()} bytes'})
+                    return
+
+                body = self.rfile.read(length)
+                is_zip = self.headers.get('Content-Type', '') in ('application/zip', 'application/x-zip-compressed')
+
+                try:
+                    result = daemon.run_job(body, is_zip)
+                except zipfile.BadZipFile:
+                    self._send(400, {'error': 'submission is not a valid zip'})
+                    return
+                except SubmissionError as e:
+                    self._send(400, {'error': str(e)})
+                    return
+
+                if result is None:
+                    self._send(503, {'error': 'too many jobs'})
+                    return
+
+                self._send(200, result, 'application/zip')
+
+        return Handler
+
+    def serve(self):
+        socket_path = Config.daemon_socket()
+        if socket_path:
+            server = _UnixHTTPServer(socket_path, self._handler())
+        else:
+            server = _ThreadingHTTPServer(Config.daemon_address(), self._handler())
+
+        logger.info('Tester daemon listening on %s', server.server_address)
+        with server:
+            server.serve_forever()
@@ -0,0 +1,99 @@
+import logging
+import threading
+import hashlib
+import json
+import os
+
+logger = logging.getLogger(__name__)
+
+class History:
+    """Small persistent record of how long phases and test cases took in
+    previous runs (exponential moving average). It is kept per tests, so
+    one cache directory can be shared by several images."""
+
+    ALPHA = 0.3 # weight of the newest sample
+
+    def __init__(self, path=None):
+        self.path = path
+        self._entries = {}
+        self._lock = threading.Lock()
+
+        if path is None:
+            return
+
+        try:
+            with open(path) as f:
+                self._entries = json.load(f)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logger.warning('Cannot load history from %s: %s', path, e)
+
+    @classmethod
+    def for_tests(cls, cache_path, tests_path):
+        if cache_path is None:
+            return cls()
+        return cls(os.path.join(cache_path, f'history-{cls.tests_key(tests_path)}.json'))
+
+    @staticmethod
+    def tests_key(tests_path):
+        """Identifies tests by their sources, build directories and the
+        submission are not part of it."""
+        digest = hashlib.sha256()
+        for root, dirs, files in os.walk(tests_path):
+            dirs[:] = sorted(d for d in dirs if not d.startswith('build-'))
+            for name in sorted(files):
+                if name == 'submission.h':
+                    continue
+                path = os.path.join(root, name)
+                digest.update(os.path.relpath(path, tests_path).encode())
+                with open(path, 'rb') as f:
+                    digest.update(hashlib.sha256(f.read()).digest())
+        return digest.hexdigest()[:16]
+
+    def get(self, key):
+        with self._lock:
+            return dict(self._entries.get(key, {}))
+
+    def cost(self, key, default):
+        return self.get(key).get('duration', default)
+
+    def failure_rate(self, key, default):
+        return self.get(key).get('failure', default)
+
+    def record(self, key, duration):
+        with self._lock:
+            entry = self._entries.setdefault(key, {'runs': 0})
+            if 'duration' in entry:
+                entry['duration'] = round(self.ALPHA * duration + (1 - self.ALPHA) * entry['duration'], 6)
+            else:
+                entry['duration'] = round(duration, 6)
+            entry['runs'] += 1
+
+    def record_bound(self, key, duration):
+        """Phase was stopped after duration, its cost is at least that."""
+        with self._lock:
+            entry = self._entries.setdefault(key, {'runs': 0})
+            entry['duration'] = round(max(entry.get('duration', 0.0), duration), 6)
+
+    def record_outcome(self, key, failed):
+        """Moving average of failures, how likely the case fails."""
+        with self._lock:
+            entry = self._entries.setdefault(key, {'runs': 0})
+            entry['failure'] = round(self.ALPHA * failed + (1 - self.ALPHA) * entry.get('failure', failed), 6)
+
+    def save(self):
+        if self.path is None:
+            return
+
+        with self._lock:
+            data = json.dumps(self._entries)
+
+        # write and rename, so concurrent containers never see a half file
+        temp = f'{self.path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        try:
+            with open(temp, 'w') as f:
+                f.write(data)
+            os.replace(temp, self.path)
+        except OSError as e:
+            logger.warning('Cannot save history to %s: %s', self.path, e)
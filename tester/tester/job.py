@@ -0,0 +1,45 @@
+import os
+from dataclasses import dataclass, field
+
+from tester.config import Config
+from tester.timeout import TimeBudget
+from tester.timings import Timings
+import tester.timeout
+import tester.timings
+
+@dataclass
+class Job:
+    """One graded submission with its own output folder, time budget and
+    timings. Single run grades one job, batch mode grades many of them."""
+    name: str
+    submission_path: str
+    output_path: str
+    budget: TimeBudget = field(default_factory=lambda: TimeBudget(Config.timeout(), Config.output_reserve()))
+    timings: Timings = field(default_factory=Timings)
+
+    @classmethod
+    def single(cls):
+        # budget and timings started together with the container
+        return cls('submission', Config.submission_path(), Config.output_path(),
+            tester.timeout.budget, tester.timings.timings)
+
+    def _path(self, *names):
+        os.makedirs(self.output_path, exist_ok=True)
+        return os.path.join(self.output_path, *names)
+
+    def build_output_path(self):
+        dir = self._path('build')
+        os.makedirs(dir, exist_ok=True)
+        return dir
+
+    def teachers_json(self):
+        return self._path('teachers.json')
+
+    def students_json(self):
+        return self._path('students.json')
+
+    def timings_json(self):
+        return self._path('timings.json')
+
+    def trace_json(self):
+        return self._path('trace.json')
@@ -0,0 +1,74 @@
+import logging
+import threading
+import hashlib
+import json
+import os
+
+from tester.config import Config
+
+logger = logging.getLogger(__name__)
+
+class ListingCache:
+    """Lists of test cases stored on disk (CACHE_PATH/listings), keyed by
+    content hash of the test binary and the tag filter. Hashes are kept in
+    memory for binaries that did not change since they were hashed."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._digests = {}
+        if path is not None:
+            os.makedirs(path, exist_ok=True)
+
+    @classmethod
+    def default(cls):
+        cache = Config.cache_path()
+        return cls(os.path.join(cache, 'listings') if cache is not None else None)
+
+    def digest(self, binary):
+        info = os.stat(binary)
+        key = (os.path.realpath(binary), info.st_mtime_ns, info.st_size)
+        with self._lock:
+            if key in self._digests:
+                return self._digests[key]
+
+        sha = hashlib.sha256()
+        with open(binary, 'rb') as f:
+            while data := f.read(1024 * 1024):
+                sha.update(data)
+
+        with self._lock:
+            self._digests[key] = sha.hexdigest()
+        return sha.hexdigest()
+
+    def _file(self, binary, tag):
+        tag = hashlib.sha256(tag.encode()).hexdigest()[:16]
+        return os.path.join(self.path, f'{self.digest(binary)}-{tag}.json')
+
+    def get(self, binary, tag):
+        """Returns cached list of test cases or None."""
+        if self.path is None:
+            return None
+
+        try:
+            with open(self._file(binary, tag)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning('Cannot read cached listing: %s', e)
+            return None
+
+    def put(self, binary, tag, test_cases):
+        if self.path is None:
+            return
+
+        file = self._file(binary, tag)
+        # write and rename, so concurrent runs never see a half file
+        temp = f'{file}.{os.getpid()}.{threading.get_ident()}.tmp'
+        try:
+            with open(temp, 'w') as f:
+                json.dump(test_cases, f)
+            os.replace(temp, file)
+        except OSError as e:
+            logger.warning('Cannot cache listing: %s', e)
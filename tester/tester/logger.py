@@ -38,21 +38,24 @@ def configure():
 
 logger = logging.getLogger(__name__)
 
-def handle_exception(exc_type, exc_value, exc_traceback):
-    try:
-        logger.exception('Uncaught exception', exc_info=(exc_type, exc_value, exc_traceback))
-        logger.debug('Creating json with errors')
+def write_exception(teachers_json, students_json):
+    logger.debug('Creating json with errors')
+
+    output = {
+        'status': 'Exception',
+        'text': 'This should never happen, please report this incident to your friendly administrators.',
+    }
 
-        output = {
-            'status': 'Exception',
-            'text': 'This should never happen, please report this incident to your friendly administrators.',
-        }
+    with open(teachers_json, 'w') as f:
+        json.dump(output, f)
 
-        with open(Config.teachers_json(), 'w') as f:
-            json.dump(output, f)
+    with open(students_json, 'w') as f:
+        json.dump(output, f)
 
-        with open(Config.students_json(), 'w') as f:
-            json.dump(output, f)
+def handle_exception(exc_type, exc_value, exc_traceback):
+    try:
+        logger.exception('Uncaught exception', exc_info=(exc_type, exc_value, exc_traceback))
+        write_exception(Config.teachers_json(), Config.students_json())
     finally:
         sys.exit(0)
 
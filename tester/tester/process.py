@@ -0,0 +1,263 @@
+import logging
+import subprocess
+import threading
+import signal
+import time
+import os
+
+logger = logging.getLogger(__name__)
+
+def _utf8_start(data):
+    # number of continuation bytes at the start, the cut split a character
+    skip = 0
+    while skip < min(3, len(data)) and data[skip] & 0xC0 == 0x80:
+        skip += 1
+    return skip
+
+def _utf8_end(data):
+    # length without the last character when the cut split it
+    for back in range(1, min(4, len(data)) + 1):
+        byte = data[-back]
+        if byte & 0xC0 != 0x80:
+            length = 1 if byte < 0x80 else 2 if byte >> 5 == 0b110 else 3 if byte >> 4 == 0b1110 else 4
+            return len(data) - back if length > back else len(data)
+    return len(data)
+
+class OutputCapture:
+    """Keeps first head and last tail bytes written, everything in between is
+    only counted. Memory is bounded no matter how much the process prints."""
+
+    def __init__(self, head, tail):
+        self.head_limit = head
+        self.tail_limit = tail
+        self.size = 0
+        self._head = bytearray()
+        self._tail = bytearray()
+
+    def write(self, data):
+        self.size += len(data)
+
+        if len(self._head) < self.head_limit:
+            take = self.head_limit - len(self._head)
+            self._head += data[:take]
+            data = data[take:]
+
+        if data and self.tail_limit > 0:
+            self._tail += data
+            # trim only from time to time, so we do not move memory on every write
+            if len(self._tail) > 2 * self.tail_limit:
+                del self._tail[:-self.tail_limit]
+
+    @property
+    def truncated(self):
+        return self.size > self.head_limit + self.tail_limit
+
+    def text(self):
+        """Captured output decoded as utf-8, cuts are moved to character
+        boundaries, so no character is split, invalid bytes are replaced."""
+        tail = bytes(self._tail[-self.tail_limit:]) if self.tail_limit > 0 else b''
+        if not self.truncated:
+            return (bytes(self._head) + tail).decode('utf-8', errors='replace')
+
+        head = bytes(self._head[:_utf8_end(self._head)])
+        tail = tail[_utf8_start(tail):]
+        skipped = self.size - len(head) - len(tail)
+        marker = f'\n[... {skipped} bytes truncated, {self.size} bytes total ...]\n'
+        return head.decode('utf-8', errors='replace') + marker + tail.decode('utf-8', errors='replace')
+
+
+class Process:
+    """Subprocess with outputs streamed to sinks (objects with write method)
+    as they come. Process runs in its own session, so the whole tree can be
+    killed when it takes too long. With sandbox (tester.sandbox.Sandbox) the
+    tree is limited and killed by its cgroup."""
+
+    def __init__(self, args, stdout, stderr, sandbox=None, **kwargs):
+        self.resources = None
+        self._start = time.monotonic()
+        self._reaped = False
+        self._lock = threading.Lock()
+        self._sandbox = sandbox
+        self._popen = subprocess.Popen(sandbox.wrap(args) if sandbox else args,
+            # sandboxed process waits for a line on stdin
+            stdin=subprocess.PIPE if sandbox and sandbox.gated else subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            start_new_session=True,
+            **kwargs)
+        self.pid = self._popen.pid
+
+        if sandbox:
+            try:
+                sandbox.start(self._popen)
+            except Exception:
+                self.kill()
+                self._popen.wait()
+                sandbox.close()
+                raise
+
+        self._readers = [
+            threading.Thread(target=self._pump, args=(self._popen.stdout, stdout), daemon=True),
+            threading.Thread(target=self._pump, args=(self._popen.stderr, stderr), daemon=True),
+        ]
+        for reader in self._readers:
+            reader.start()
+
+        # wait for exit without reaping, while the process is a zombie its
+        # group cannot be reused, so it is safe to kill it
+        self._exited = threading.Event()
+        threading.Thread(target=self._wait_exit, daemon=True).start()
+
+    def _wait_exit(self):
+        try:
+            os.waitid(os.P_PID, self.pid, os.WEXITED | os.WNOWAIT)
+        finally:
+            self._wall_time = time.monotonic() - self._start
+            self._exited.set()
+
+    @staticmethod
+    def _pump(pipe, sink):
+        with pipe:
+            while data := os.read(pipe.fileno(), 65536):
+                sink.write(data)
+
+    def kill(self):
+        # can be called from other threads (watchers), once the process is
+        # reaped its group id can be reused by someone else
+        with self._lock:
+            if self._reaped:
+                return
+
+            try:
+                os.killpg(self.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass # already gone
+
+            # processes that left the session are still in the cgroup
+            if self._sandbox:
+                self._sandbox.kill()
+
+    def cpu_time(self):
+        """Seconds of cpu used by the process tree so far, including children
+        that already finished."""
+        if self._sandbox and self._sandbox.gated:
+            return self._sandbox.cpu_time()
+
+        # processes of the tree stay in our session unless they leave it
+        ticks = 0
+        for entry in os.listdir('/proc'):
+            if not entry.isdigit():
+                continue
+            try:
+                with open(f'/proc/{entry}/stat') as f:
+                    fields = f.read().rsplit(')', 1)[1].split()
+            except (OSError, IndexError):
+                continue # already gone
+            if int(fields[3]) == self.pid:
+                ticks += sum(int(field) for field in fields[11:15])
+
+        return ticks / os.sysconf('SC_CLK_TCK')
+
+    def wait(self, timeout):
+        """Returns return code of the process. When timeout expires the process
+        tree is killed and subprocess.TimeoutExpired is raised."""
+        timed_out = not self._exited.wait(timeout)
+        if timed_out:
+            self.kill()
+            self._exited.wait()
+
+        # children might still hold our pipes, they have no business running
+        self.kill()
+        returncode = self._reap()
+        self._join()
+
+        if timed_out:
+            raise subprocess.TimeoutExpired(self._popen.args, timeout)
+
+        return returncode
+
+    def _reap(self):
+        # reap it ourselves to get resource usage, it contains all children
+        # the process waited for (submission started by tests)
+        with self._lock:
+            _, status, usage = os.wait4(self.pid, 0)
+            self._popen.returncode = os.waitstatus_to_exitcode(status)
+            self._reaped = True
+
+        self.resources = {
+            'wall_time': round(self._wall_time, 6),
+            'user_time': round(usage.ru_utime, 6),
+            'system_time': round(usage.ru_stime, 6),
+            'max_rss_kb': usage.ru_maxrss,
+            'minor_faults': usage.ru_minflt,
+            'major_faults': usage.ru_majflt,
+            'voluntary_switches': usage.ru_nvcsw,
+            'involuntary_switches': usage.ru_nivcsw,
+            'block_input': usage.ru_inblock,
+            'block_output': usage.ru_oublock,
+        }
+        if self._sandbox:
+            self.resources.update(self._sandbox.close())
+        return self._popen.returncode
+
+    def _join(self):
+        for reader in self._readers:
+            reader.join(timeout=5)
+            if reader.is_alive():
+                logger.warning('Output of process %d is still open', self.pid)
+
+
+class IdleWatchdog:
+    """Samples cpu time of the process tree, when it does not grow for window
+    seconds (deadlock, waiting for input that never comes) the callback is
+    called once and watching stops."""
+
+    def __init__(self, process, window, callback):
+        self.idle = False
+        self._process = process
+        self._window = window
+        self._callback = callback
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._watch, daemon=True)
+        self._thread.start()
+
+    def _watch(self):
+        # a few samples per window, so idle is noticed soon after it expires
+        interval = min(1.0, self._window / 4)
+        last, since = self._process.cpu_time(), time.monotonic()
+
+        while not self._stopped.wait(interval):
+            used = self._process.cpu_time()
+            # scheduler noise or a clock tick from a blocked thread is no progress
+            if used - last > 0.01:
+                last, since = used, time.monotonic()
+            elif time.monotonic() - since >= self._window:
+                self.idle = True
+                self._callback()
+                return
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+
+def run(args, timeout, stdout, stderr, **kwargs):
+    return Process(args, stdout, stderr, **kwargs).wait(timeout)
+
+
+def summarize(resources):
+    """Sums resource usage of several processes, peaks are kept as maximum."""
+    resources = [r for r in resources if r]
+    summary = {'processes': len(resources)}
+    for key in ['wall_time', 'user_time', 'system_time', 'minor_faults', 'major_faults',
+                'voluntary_switches', 'involuntary_switches', 'block_input', 'block_output']:
+        summary[key] = sum(r.get(key, 0) for r in resources)
+    summary['max_wall_time'] = max((r.get('wall_time', 0) for r in resources), default=0)
+    summary['max_rss_kb'] = max((r.get('max_rss_kb', 0) for r in resources), default=0)
+    # cgroup accounting is there only for sandboxed processes
+    for key in ['cgroup_cpu_usec', 'cgroup_throttled_usec', 'oom_kills']:
+        if any(key in r for r in resources):
+            summary[key] = sum(r.get(key, 0) for r in resources)
+    if any('cgroup_memory_peak' in r for r in resources):
+        summary['cgroup_memory_peak'] = max(r.get('cgroup_memory_peak', 0) for r in resources)
+    return {key: round(value, 6) for key, value in summary.items()}
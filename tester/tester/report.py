@@ -0,0 +1,134 @@
+import logging
+import xml.etree.ElementTree as ET
+from dataclasses import dataclass
+
+logger = logging.getLogger(__name__)
+
+# output of the test case, it is streamed into captures
+OUTPUTS = ('StdOut', 'StdErr')
+
+@dataclass
+class CaseReport:
+    success: bool
+    duration: float
+    summary: str # rendered similar to catch2 console reporter
+    stdout: object # tester.process.OutputCapture
+    stderr: object
+
+
+class _Target:
+    """Builds elements of test cases, text of StdOut and StdErr is written
+    to captures instead, so their size does not matter."""
+
+    def __init__(self, report):
+        self._report = report
+        self._builder = ET.TreeBuilder()
+        self._depth = 0
+        self._root = None
+        self._outputs = {}
+        self._capture = None
+
+    def start(self, tag, attrib):
+        element = self._builder.start(tag, attrib)
+        if self._root is None:
+            self._root = element
+        self._depth += 1
+
+        if tag in OUTPUTS:
+            self._capture = self._outputs.setdefault(tag, self._report.capture())
+
+    def data(self, data):
+        if self._capture is not None:
+            self._capture.write(data.encode('utf-8'))
+        else:
+            self._builder.data(data)
+
+    def end(self, tag):
+        element = self._builder.end(tag)
+        self._depth -= 1
+
+        if tag in OUTPUTS:
+            self._capture = None
+        # test cases are direct children of the root element
+        elif tag == 'TestCase' and self._depth == 1:
+            self._report.cases[element.get('name')] = self._report._case(element, self._outputs)
+            self._root.remove(element)
+            self._outputs = {}
+        # totals of the run, failed assertions (not cases)
+        elif tag == 'OverallResults' and self._depth == 1:
+            self._report.failures = int(element.get('failures', '0'))
+
+    def close(self):
+        return self._builder.close()
+
+
+class XmlReport:
+    """Incremental parser of catch2 xml reporter output. Data can be fed as
+    they come, finished test cases are available in cases. Output of process
+    which crashed is fine, cases that did not finish are just missing. Output
+    of cases goes to captures made by capture (bounded, whatever they print).
+    Failed assertions of the whole run are in failures once it finished."""
+
+    def __init__(self, capture):
+        self.cases = {}
+        self.failures = None
+        self.broken = False
+        self.capture = capture
+        self._parser = ET.XMLParser(target=_Target(self))
+
+    def feed(self, data):
+        if self.broken:
+            return
+
+        try:
+            self._parser.feed(data)
+        except ET.ParseError as e:
+            # something else wrote to stdout, everything after is lost
+            logger.warning('Cannot parse catch2 xml output: %s', e)
+            self.broken = True
+
+    write = feed # to be usable as process output
+
+    @staticmethod
+    def _duration(element):
+        return float(element.get('durationInSeconds', '0'))
+
+    def _case(self, case, outputs):
+        lines = []
+
+        def location(element):
+            return f'{element.get("filename")}:{element.get("line")}'
+
+        def text(element, tag):
+            return (element.findtext(tag) or '').strip()
+
+        for element in case.iter():
+            if element.tag == 'Expression':
+                status = 'PASSED' if element.get('success') == 'true' else 'FAILED'
+                lines.append(f'{location(element)}: {status}:')
+                lines.append(f'  {element.get("type")}( {text(element, "Original")} )')
+                if text(element, 'Expanded') != text(element, 'Original'):
+                    lines.append('with expansion:')
+                    lines.append(f'  {text(element, "Expanded")}')
+            elif element.tag in ('Exception', 'FatalErrorCondition', 'Failure'):
+                lines.append(f'{location(element)}: FAILED:')
+                lines.append(f'  {element.tag}: {(element.text or "").strip()}')
+            elif element.tag in ('Info', 'Warning'):
+                lines.append(f'  {(element.text or "").strip()}')
+
+        # durations go last, the same way as with --durations yes
+        for section in case.iter('Section'):
+            results = section.find('OverallResults')
+            if results is not None and 'durationInSeconds' in results.attrib:
+                lines.append(f'{self._duration(results):.3f} s: {section.get("name")}')
+
+        result = case.find('OverallResult')
+        duration = self._duration(result) if result is not None else 0.0
+        lines.append(f'{duration:.3f} s: {case.get("name")}')
+
+        return CaseReport(
+            success=result is not None and result.get('success') == 'true',
+            duration=duration,
+            summary='\n'.join(lines) + '\n',
+            stdout=outputs.get('StdOut') or self.capture(),
+            stderr=outputs.get('StdErr') or self.capture())
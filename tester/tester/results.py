@@ -0,0 +1,156 @@
+import logging
+import threading
+import tempfile
+import shutil
+import gzip
+import json
+import os
+
+from tester.config import Config
+from tester.tests import TestResultStatus
+import tester.process
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+class ResultWriter:
+    """Writes teachers.json and students.json. Test cases are spooled to disk
+    as they finish (only their summaries stay in memory), both files are
+    then written case by case, students data are derived from the teachers
+    case. Long fields are capped (RESULT_FIELD_LIMIT), output can be compact
+    and compressed (RESULT_FORMAT, RESULT_COMPRESSION)."""
+
+    def __init__(self, job):
+        self._job = job
+        self._lock = threading.Lock()
+        self._spool = tempfile.mkdtemp(prefix='apc-results-')
+        self._files = {}
+        self._offsets = {}
+        self._indent = None if Config.result_format() == 'compact' else 2
+        self._limit = Config.result_field_limit()
+
+    def _cap(self, text):
+        if not self._limit or len(text) <= self._limit:
+            return text
+
+        # characters, not bytes, so multibyte characters are never split
+        head, tail = self._limit // 2, self._limit - self._limit // 2
+        skipped = len(text) - head - tail
+        marker = f'\n[... {skipped} characters truncated, {len(text)} characters total ...]\n'
+        return text[:head] + marker + (text[-tail:] if tail else '')
+
+    def add_case(self, configuration, name, result):
+        """Spools finished test case, returns its summary to keep in memory."""
+        case = {
+            'name': name,
+            'result': dict(status=result.get_status(), **{key: value for key, value in result.__dict__.items() if key != 'status'}),
+        }
+        case['result']['stdout'] = self._cap(case['result']['stdout'])
+        case['result']['stderr'] = self._cap(case['result']['stderr'])
+        line = json.dumps(case) + '\n'
+
+        with self._lock:
+            if configuration not in self._files:
+                self._files[configuration] = open(os.path.join(self._spool, f'{configuration}.jsonl'), 'wb')
+                self._offsets[configuration] = {}
+            f = self._files[configuration]
+            # cases finish in any order, they are written in the order of tests
+            self._offsets[configuration][name] = f.tell()
+            f.write(line.encode())
+
+        return result.summary()
+
+    def _open(self, path):
+        compression = Config.result_compression()
+        if compression == 'zstd' and zstandard is None:
+            logger.warning('zstandard is not installed, gzip is used instead')
+            compression = 'gzip'
+
+        if compression == 'gzip':
+            return gzip.open(f'{path}.gz', 'wt', encoding='utf-8')
+        if compression == 'zstd':
+            return zstandard.open(f'{path}.zst', 'wt', encoding='utf-8')
+        return open(path, 'w')
+
+    def _dump(self, value, level):
+        if self._indent is None:
+            return json.dumps(value, separators=(',', ':'))
+        return json.dumps(value, indent=self._indent).replace('\n', '\n' + ' ' * self._indent * level)
+
+    def _newline(self, level):
+        return '' if self._indent is None else '\n' + ' ' * self._indent * level
+
+    def _key(self, name):
+        return json.dumps(name) + (':' if self._indent is None else ': ')
+
+    @staticmethod
+    def _student_case(case):
+        result = case['result']
+
+        # do not propagate this verbose status
+        status = result['status']
+        if status != TestResultStatus.SUCCESS:
+            status = TestResultStatus.FAILED
+
+        filtered = {'status': status}
+        if Config.show_results_to_students():
+            filtered['stdout'] = result['stdout']
+            filtered['returncode'] = result['returncode']
+
+        return {'name': case['name'], 'result': filtered}
+
+    def write(self, binaries, tests_result, staging):
+        logger.debug('Creating json with tests results')
+
+        with self._lock:
+            for f in self._files.values():
+                f.close()
+
+        def compilation(fields):
+            return [{
+                'binary': binary,
+                'configurations': [{
+                    'name': name,
+                    'result': {key: self._cap(value) if key == 'compiler_output' else value
+                        for key, value in result.__dict__.items() if fields is None or key in fields}
+                } for name, result in configurations.items()]
+            } for binary, configurations in binaries.items()]
+
+        # documents are written by hand, so only one case is in memory
+        nl, key = self._newline, self._key
+        with self._open(self._job.teachers_json()) as teachers, self._open(self._job.students_json()) as students:
+            teachers.write('{' + nl(1) + key('compilation') + self._dump(compilation(None), 1) + ',' + nl(1) + key('tests') + '[')
+            students.write('{' + nl(1) + key('compilation') + self._dump(compilation(['errno', 'compiler_output']), 1) + ',' + nl(1) + key('tests') + '[')
+
+            for i, (configuration, cases) in enumerate(tests_result.items()):
+                separator = ',' if i > 0 else ''
+                for f in (teachers, students):
+                    f.write(separator + nl(2) + '{' + nl(3) + key('configuration') + json.dumps(configuration) + ',' + nl(3) + key('cases') + '[')
+
+                offsets = self._offsets.get(configuration, {})
+                if offsets:
+                    with open(os.path.join(self._spool, f'{configuration}.jsonl'), 'rb') as f:
+                        for j, name in enumerate(cases):
+                            f.seek(offsets[name])
+                            case = json.loads(f.readline())
+                            separator = ',' if j > 0 else ''
+                            teachers.write(separator + nl(4) + self._dump(case, 4))
+                            students.write(separator + nl(4) + self._dump(self._student_case(case), 4))
+
+                summary = tester.process.summarize(result.resources for result in cases.values())
+                teachers.write(nl(3) + '],' + nl(3) + key('summary') + self._dump(summary, 3) + nl(2) + '}')
+                students.write(nl(3) + ']' + nl(2) + '}')
+
+            teachers.write(nl(1) + '],' + nl(1) + key('staging') + self._dump(dict(staging.stats), 1))
+            teachers.write(',' + nl(1) + key('budget') + self._dump(self._job.budget.report(), 1) + nl(0) + '}')
+            students.write(nl(1) + ']' + nl(0) + '}')
+
+    def cleanup(self):
+        with self._lock:
+            for f in self._files.values():
+                f.close()
+        shutil.rmtree(self._spool, ignore_errors=True)
@@ -0,0 +1,237 @@
+import logging
+import threading
+import signal
+import uuid
+import time
+import os
+
+from tester.config import Config, Configuration
+
+logger = logging.getLogger(__name__)
+
+# controllers we set limits with
+CONTROLLERS = ('memory', 'cpu', 'pids')
+
+# period of cpu.max in microseconds
+CPU_PERIOD = 100000
+
+class CgroupRoot:
+    """Delegated cgroup v2 hierarchy (the container gets one with
+    --cgroupns=private). Tester itself is moved to a leaf group, so that
+    controllers can be enabled for groups of tests created next to it."""
+
+    def __init__(self, path):
+        self.path = path
+
+        with open(os.path.join(path, 'cgroup.controllers')) as f:
+            available = f.read().split()
+
+        # no internal processes rule, processes must live in leaves
+        leaf = os.path.join(path, 'tester')
+        os.makedirs(leaf, exist_ok=True)
+        with open(os.path.join(path, 'cgroup.procs')) as f:
+            pids = f.read().split()
+        for pid in pids:
+            try:
+                _write(os.path.join(leaf, 'cgroup.procs'), pid)
+            except ProcessLookupError:
+                pass # already gone
+
+        enable = ' '.join(f'+{c}' for c in CONTROLLERS if c in available)
+        if enable:
+            _write(os.path.join(path, 'cgroup.subtree_control'), enable)
+
+    def create(self, limits):
+        return Cgroup(os.path.join(self.path, f'test-{uuid.uuid4().hex[:12]}'), limits)
+
+
+class Cgroup:
+    def __init__(self, path, limits):
+        self.path = path
+        os.mkdir(path)
+
+        try:
+            if limits.get('memory'):
+                self._set('memory.max', limits['memory'])
+                if os.path.exists(self._file('memory.swap.max')):
+                    self._set('memory.swap.max', 0)
+            if limits.get('cpu'):
+                self._set('cpu.max', f'{int(limits["cpu"] * CPU_PERIOD)} {CPU_PERIOD}')
+            if limits.get('pids'):
+                self._set('pids.max', limits['pids'])
+        except OSError:
+            os.rmdir(path)
+            raise
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def _set(self, name, value):
+        _write(self._file(name), str(value))
+
+    def _read(self, name):
+        try:
+            with open(self._file(name)) as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def _stat(self, name):
+        lines = [line.split() for line in (self._read(name) or '').splitlines()]
+        return {line[0]: int(line[1]) for line in lines if len(line) == 2}
+
+    def attach(self, pid):
+        self._set('cgroup.procs', pid)
+
+    def kill(self):
+        try:
+            self._set('cgroup.kill', 1)
+            return
+        except FileNotFoundError:
+            pass # kernel older than 5.14
+        except OSError as e:
+            logger.warning('Cannot kill cgroup %s: %s', self.path, e)
+
+        for pid in (self._read('cgroup.procs') or '').split():
+            try:
+                os.kill(int(pid), signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+
+    def cpu_time(self):
+        return self._stat('cpu.stat').get('usage_usec', 0) / 1e6
+
+    def accounting(self):
+        cpu = self._stat('cpu.stat')
+        memory = self._stat('memory.events')
+        result = {
+            'cgroup_cpu_usec': cpu.get('usage_usec', 0),
+            'cgroup_user_usec': cpu.get('user_usec', 0),
+            'cgroup_system_usec': cpu.get('system_usec', 0),
+            'cgroup_throttled_usec': cpu.get('throttled_usec', 0),
+            'oom_kills': memory.get('oom_kill', 0),
+        }
+
+        # these are available only in newer kernels
+        for name, key in [('memory.peak', 'cgroup_memory_peak'), ('pids.peak', 'cgroup_pids_peak')]:
+            value = self._read(name)
+            if value is not None and value.strip().isdigit():
+                result[key] = int(value)
+        return result
+
+    def remove(self):
+        # cgroup can be removed only when it is empty
+        for _ in range(100):
+            if 'populated 0' in (self._read('cgroup.events') or 'populated 0'):
+                break
+            self.kill()
+            time.sleep(0.01)
+
+        try:
+            os.rmdir(self.path)
+        except OSError as e:
+            logger.warning('Cannot remove cgroup %s: %s', self.path, e)
+
+
+def _write(path, value):
+    with open(path, 'w') as f:
+        f.write(value)
+
+
+_root = None
+_root_lock = threading.Lock()
+_root_failed = False
+
+def _cgroup_root():
+    """Returns CgroupRoot, or None when cgroups v2 cannot be used (the first
+    failure is logged, rlimits are used instead)."""
+    global _root, _root_failed
+    with _root_lock:
+        if _root is None and not _root_failed:
+            path = Config.cgroup_path()
+            try:
+                if path is None:
+                    raise OSError('cgroups are disabled')
+                _root = CgroupRoot(path)
+                logger.info('Tests are isolated in cgroups under %s', path)
+            except OSError as e:
+                logger.warning('Cannot use cgroup v2 in %s (%s), falling back to rlimits', path, e)
+                _root_failed = True
+        return _root
+
+
+class Sandbox:
+    """Limits of one test process tree (TEST_MEMORY_LIMIT, TEST_CPU_LIMIT,
+    TEST_PIDS_LIMIT). The process waits at start until it is moved to its
+    cgroup, so nothing runs unlimited, rlimits are set by prlimit utility
+    when cgroups are not available."""
+
+    # waits for a line on stdin, then runs the test without stdin
+    GATE = ['/bin/sh', '-c', 'read -r _; exec "$@" </dev/null', 'sh']
+
+    def __init__(self, limits, sanitized):
+        self.limits = limits
+        self._sanitized = sanitized
+        self._cgroup = None
+
+        root = _cgroup_root()
+        if root is not None:
+            try:
+                self._cgroup = root.create(limits)
+            except OSError as e:
+                logger.warning('Cannot create cgroup (%s), falling back to rlimits', e)
+
+    @classmethod
+    def create(cls, configuration):
+        """Returns sandbox for test in configuration, None if no limits are set."""
+        limits = Config.test_limits()
+        if not any(limits.values()):
+            return None
+        # sanitizers reserve terabytes of address space
+        return cls(limits, configuration == Configuration.DEBUG)
+
+    @property
+    def gated(self):
+        return self._cgroup is not None
+
+    def wrap(self, args):
+        if self.gated:
+            return [*self.GATE, *args]
+
+        # prlimit syscall on process of another user needs CAP_SYS_RESOURCE,
+        # which docker drops, the test lowers its own limits instead
+        limits = []
+        if self.limits.get('pids'):
+            # processes of one user are counted together, it is a fork bomb
+            # protection rather than a precise limit
+            limits.append(f'--nproc={self.limits["pids"] * Config.test_workers()}')
+        if self.limits.get('memory') and not self._sanitized:
+            limits.append(f'--as={self.limits["memory"]}')
+        # there is no rlimit for cpu bandwidth, wall clock timeout is enough
+        return ['prlimit', *limits, '--', *args]
+
+    def start(self, popen):
+        """Puts gated process into its cgroup and lets it run."""
+        if not self.gated:
+            return
+
+        self._cgroup.attach(popen.pid)
+        popen.stdin.write(b'\n')
+        popen.stdin.close()
+
+    def cpu_time(self):
+        return self._cgroup.cpu_time()
+
+    def kill(self):
+        if self._cgroup is not None:
+            self._cgroup.kill()
+
+    def close(self):
+        """Kills whatever is left, returns accounting of the cgroup."""
+        if self._cgroup is None:
+            return {'sandbox': 'rlimit'}
+
+        self._cgroup.kill()
+        accounting = self._cgroup.accounting()
+        self._cgroup.remove()
+        return dict(accounting, sandbox='cgroup')
@@ -0,0 +1,74 @@
+import logging
+import concurrent.futures
+
+logger = logging.getLogger(__name__)
+
+class TaskSkipped(Exception):
+    def __init__(self, name, dependency):
+        super().__init__(f'Task "{name}" skipped, dependency "{dependency}" failed')
+        self.name = name
+        self.dependency = dependency
+
+
+class Scheduler:
+    """Very small dependency scheduler, every task is started as soon as all
+    its dependencies are finished. Tasks are plain callables, results of
+    finished tasks are available through result()."""
+
+    def __init__(self):
+        self._tasks = {}
+        self._futures = {}
+
+    def add(self, name, fn, depends=()):
+        for dependency in depends:
+            if dependency not in self._tasks:
+                raise ValueError(f'Unknown dependency "{dependency}" of task "{name}"')
+
+        self._tasks[name] = (fn, tuple(depends))
+        return name
+
+    def result(self, name):
+        return self._futures[name].result()
+
+    def run(self):
+        """Runs all tasks and returns dictionary with their results. When task
+        raises, its dependants are skipped and the exception is reraised
+        after everything else is finished."""
+        waiting = dict(self._tasks)
+        running = {}
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, len(waiting))) as executor:
+            while waiting or running:
+                for name, (fn, depends) in list(waiting.items()):
+                    if not all(d in self._futures and self._futures[d].done() for d in depends):
+                        continue
+
+                    del waiting[name]
+                    failed = [d for d in depends if self._futures[d].exception() is not None]
+                    if failed:
+                        logger.warning('Skipping task "%s", dependency "%s" failed', name, failed[0])
+                        future = concurrent.futures.Future()
+                        future.set_exception(TaskSkipped(name, failed[0]))
+                        self._futures[name] = future
+                        continue
+
+                    logger.debug('Starting task "%s"', name)
+                    future = executor.submit(fn)
+                    self._futures[name] = future
+                    running[future] = name
+
+                if not running:
+                    if waiting: # skipped tasks may have unblocked something
+                        continue
+                    break
+
+                done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    logger.debug('Task "%s" finished', running.pop(future))
+
+        for name, future in self._futures.items():
+            exception = future.exception()
+            if exception is not None and not isinstance(exception, TaskSkipped):
+                raise exception
+
+        return {name: future.result() for name, future in self._futures.items()}
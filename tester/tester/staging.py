@@ -0,0 +1,102 @@
+import logging
+import tempfile
+import shutil
+import threading
+import contextlib
+import collections
+import fcntl
+import errno
+import os
+
+logger = logging.getLogger(__name__)
+
+# from linux/fs.h, clones file content on copy on write filesystems
+FICLONE = 0x40049409
+
+class Staging:
+    """Binaries are staged once into a shared read only directory (hardlink,
+    reflink or copy as the last resort) and every test run gets its own
+    scratch directory, which is removed right after the run."""
+
+    def __init__(self):
+        self.path = tempfile.mkdtemp(prefix='apc-stage-')
+        os.chmod(self.path, 0o755) # tests can read and execute, not modify
+
+        self.stats = collections.Counter()
+        self._staged = {}
+        self._lock = threading.Lock()
+
+    def stage(self, source, name):
+        """Returns path to read only version of source named name, the same
+        source is staged only once (until it changes)."""
+        info = os.stat(source)
+        key = (os.path.realpath(source), name, info.st_mtime_ns, info.st_size)
+
+        with self._lock:
+            if key in self._staged:
+                return self._staged[key]
+
+            folder = os.path.join(self.path, str(len(self._staged)))
+            os.mkdir(folder)
+            os.chmod(folder, 0o755)
+
+            path = os.path.join(folder, name)
+            method = self._place(source, path)
+            os.chmod(path, 0o755)
+
+            self.stats[f'files_{method}'] += 1
+            if method == 'copied':
+                self.stats['bytes_copied'] += info.st_size
+
+            logger.debug('Staged "%s" as "%s" (%s)', source, path, method)
+            self._staged[key] = path
+            return path
+
+    @staticmethod
+    def _place(source, path):
+        try:
+            os.link(source, path)
+            return 'linked'
+        except OSError as e:
+            if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP):
+                raise
+
+        try:
+            with open(source, 'rb') as src, open(path, 'wb') as dst:
+                fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+            return 'reflinked'
+        except OSError:
+            pass
+
+        shutil.copyfile(source, path)
+        return 'copied'
+
+    @contextlib.contextmanager
+    def scratch(self):
+        """Temporary working directory for one test run, removed afterwards."""
+        path = tempfile.mkdtemp(prefix='apc-run-')
+        os.chmod(path, 0o777) # everyone os allowed to do everything
+
+        try:
+            yield path
+        finally:
+            used = self._disk_usage(path)
+            shutil.rmtree(path, ignore_errors=True)
+
+            with self._lock:
+                self.stats['scratch_dirs'] += 1
+                self.stats['scratch_bytes'] += used
+                self.stats['scratch_peak_bytes'] = max(self.stats['scratch_peak_bytes'], used)
+
+    @staticmethod
+    def _disk_usage(path):
+        used = 0
+        for root, _, files in os.walk(path):
+            for name in files:
+                with contextlib.suppress(OSError):
+                    used += os.lstat(os.path.join(root, name)).st_blocks * 512
+        return used
+
+    def cleanup(self):
+        logger.info('Staging statistics %s', dict(self.stats))
+        shutil.rmtree(self.path, ignore_errors=True)
@@ -1,14 +1,27 @@
 import logging
-import tempfile
-import shutil
 import subprocess
+import threading
+import contextlib
+import statistics
+import shutil
+import math
+import json
+import time
+import re
+import concurrent.futures
 from enum import Enum
 from typing import Final
 import os, pwd
+import dataclasses
 from dataclasses import dataclass
 
-from tester.timeout import TimeoutManager
-from tester.config import Config, Configuration, SubmissionMode
+from tester.timeout import budget
+from tester.timings import timings
+from tester.config import Config, Configuration
+from tester.report import XmlReport
+from tester.listing import ListingCache
+from tester.sandbox import Sandbox
+import tester.process
 
 logger = logging.getLogger(__name__)
 
@@ -26,6 +39,74 @@ class TestResultStatus(str, Enum):
     LEAK_SANITIZER = 'Leak sanitizer'
     ADDR_SANITIZER = 'Address sanitizer'
     DBG_CONTAINERS = 'Debug containers'
+    DEADLOCK = 'Deadlock'
+    SKIPPED = 'Skipped'
+
+
+def is_dbg_container(text):
+    return (text.find('In function:') != -1
+        and text.find('Error:') != -1 and text.find('__debug') != -1)
+
+
+class SignatureMatcher:
+    """Scans stream (stderr) as it comes for reports which make the status of
+    the test certain, the same ones TestResult.get_status looks for. Data
+    are passed to sink, callback set by on_match is called once with the
+    status (immediately if it was already found). Only fatal errors are
+    matched, leaks are reported when a process exits, it can be a child
+    of the test which does not decide its result, so they are left to the
+    status of the finished test."""
+
+    SANITIZERS: Final = {
+        b'ERROR: AddressSanitizer': TestResultStatus.ADDR_SANITIZER,
+    }
+    DBG_CONTAINER: Final = (b'In function:', b'Error:', b'__debug')
+
+    def __init__(self, sink):
+        self.status = None
+        self.time = None
+        self._sink = sink
+        self._callback = None
+        self._lock = threading.Lock()
+        self._start = time.monotonic()
+        self._seen = set()
+        self._carry = b''
+        self._overlap = max(map(len, [*self.SANITIZERS, *self.DBG_CONTAINER])) - 1
+
+    def write(self, data):
+        self._sink.write(data)
+        if self.status is not None:
+            return
+
+        # tokens can be split between two writes
+        window = self._carry + data
+        self._carry = window[-self._overlap:]
+        self._seen.update(token for token in [*self.SANITIZERS, *self.DBG_CONTAINER] if token in window)
+
+        for token, status in self.SANITIZERS.items():
+            if token in self._seen:
+                self._match(status)
+                return
+
+        if self._seen.issuperset(self.DBG_CONTAINER):
+            self._match(TestResultStatus.DBG_CONTAINERS)
+
+    def _match(self, status):
+        with self._lock:
+            self.status = status
+            self.time = round(time.monotonic() - self._start, 6)
+            callback = self._callback
+
+        if callback is not None:
+            callback(status)
+
+    def on_match(self, callback):
+        with self._lock:
+            self._callback = callback
+            status = self.status
+
+        if status is not None:
+            callback(status)
 
 
 @dataclass
@@ -33,14 +114,23 @@ class TestResult:
     returncode: int
     stdout: str
     stderr: str
+    stdout_size: int = 0 # before truncation
+    stderr_size: int = 0
+    resources: dict = None # see tester.process.Process
+    signature: dict = None # report found in stderr while running
+    benchmark: dict = None # statistics of repeated runs, see Tests.run_benchmark
+    status: TestResultStatus = None # known status (summary without outputs, deadlock)
+
+    def summary(self):
+        return dataclasses.replace(self, stdout='', stderr='', status=self.get_status())
 
     def get_status(self):
+        if self.status is not None:
+            return self.status
+
         if self.returncode == -2147483649:
             return TestResultStatus.TIMEOUT
 
-        is_dbg_container = lambda x: (x.find('In function:') != -1
-            and x.find('Error:') != -1 and x.find('__debug') != -1)
-
         if self.returncode != 0:
             if self.stderr.find('ERROR: LeakSanitizer') != -1:
                 return TestResultStatus.LEAK_SANITIZER
@@ -59,89 +149,508 @@ class TestResult:
         return TestResultStatus.SUCCESS
 
 
+# statuses counted by fail fast, the test crashed or had to be stopped
+CRASHES: Final = {
+    TestResultStatus.TIMEOUT,
+    TestResultStatus.LEAK_SANITIZER,
+    TestResultStatus.ADDR_SANITIZER,
+    TestResultStatus.DBG_CONTAINERS,
+    TestResultStatus.DEADLOCK,
+}
+
+
+def is_crash(result):
+    status = result.get_status()
+    if status in CRASHES:
+        return True
+    # killed by signal (segfault, abort)
+    return status == TestResultStatus.FAILED and result.returncode is not None and result.returncode < 0
+
+
+def describe(values):
+    """Median, 90th percentile and spread of measured values."""
+    values = sorted(values)
+    return {
+        'median': round(statistics.median(values), 6),
+        'p90': round(values[math.ceil(0.9 * len(values)) - 1], 6),
+        'stddev': round(statistics.stdev(values), 6) if len(values) > 1 else 0.0,
+        'min': round(values[0], 6),
+        'max': round(values[-1], 6),
+    }
+
+
+def list_tests(binary, configuration, listings, timings = timings, tags = ''):
+    """Returns test cases of binary for configuration (and tags), the binary
+    is started only when the listing is not cached."""
+    logger.debug('Listing all unittest for binary "%s", with configuration "%s"', binary, str(configuration))
+
+    tag = f'[{configuration}]{tags}'
+    cached = listings.get(binary, tag)
+    if cached is not None:
+        logger.debug('Using cached listing %s', cached)
+        return cached
+
+    args = [binary, '--list-tests', '--verbosity', 'quiet', tag]
+    with timings.phase(f'list-tests/{configuration}'):
+        catch = subprocess.run(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=5)
+
+    if catch.returncode != 0 and len(catch.stderr) != 0:
+        logger.error('Cannot list unittests from binary "%s" errno %d', binary, catch.returncode)
+        stderr = (catch.stderr or b'').decode('utf-8')
+        raise ListTestsError(catch.returncode, stderr, binary)
+
+    stdout = catch.stdout.decode('utf-8')
+    logger.debug('List of all tests returned "%s"', stdout)
+
+    if catch.returncode == 0:
+        listings.put(binary, tag, stdout.splitlines())
+    return stdout.splitlines()
+
+
 class Tests:
     CATCH_EXEC_NAME: Final = 'main'
     SUBMISSION_EXEC_NAME: Final = 'submission'
 
-    def __init__(self, binary, configuration):
+    # configurations may run tests at the same time, but the number of
+    # running test processes is limited for the whole tester, slots are
+    # created on first use, so they follow the configuration of the run
+    _shared_lock = threading.Lock()
+    _shared_slots = None # (semaphore, count)
+    _exclusive_lock = threading.Lock()
+
+    # durations printed by catch2 with --durations yes
+    DURATION: Final = re.compile(r'^(\d+\.\d+) s: (.+)$', re.MULTILINE)
+
+    # listings do not change with the binary, it is started only on miss,
+    # one cache per CACHE_PATH
+    _shared_listings = {}
+
+    def __init__(self, binary, configuration, staging, submission_binary = None, budget = budget, timings = timings):
         self.binary = binary
         self.configuration = configuration
+        self._staging = staging
+        self._budget = budget
+        self._timings = timings
+        self._slots, self._workers = self._test_slots()
+        self._listings = self._listing_cache()
         self._options = ['--durations', 'yes', '--invisibles']
         if self.configuration == Configuration.DEBUG:
             self._options.append('--success')
-        self.test_cases = self._list_tests()
-
 
-    def _list_tests(self):
-        logger.debug('Listing all unittest for binary "%s", with configuration "%s"', self.binary, str(self.configuration))
+        # binaries are staged right away, build trees can be reused by
+        # another submission once the tests are created
+        self._catch_path = self._staging.stage(self.binary, self.CATCH_EXEC_NAME)
+        self._submission_path = None
+        if submission_binary:
+            self._submission_path = self._staging.stage(submission_binary, self.SUBMISSION_EXEC_NAME)
 
-        temp_dir = tempfile.mkdtemp()
-        temp = os.path.join(temp_dir, self.CATCH_EXEC_NAME)
-        shutil.copy2(self.binary, temp)
+        self.test_cases = self._list_tests()
+        self.benchmark_cases = self._list_benchmarks()
+
+    @classmethod
+    def _test_slots(cls):
+        with cls._shared_lock:
+            if cls._shared_slots is None:
+                workers = Config.test_workers()
+                cls._shared_slots = (threading.BoundedSemaphore(workers), workers)
+            return cls._shared_slots
+
+    @classmethod
+    def _listing_cache(cls):
+        path = Config.cache_path()
+        with cls._shared_lock:
+            if path not in cls._shared_listings:
+                cls._shared_listings[path] = ListingCache.default()
+            return cls._shared_listings[path]
 
-        args = [temp, '--list-tests', '--verbosity', 'quiet', f'[{self.configuration}]']
-        catch = subprocess.run(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=5)
+    def _list_tests(self):
+        return list_tests(self._catch_path, self.configuration, self._listings, self._timings)
+
+    def _list_benchmarks(self):
+        # sanitizers and --success make timings of debug meaningless
+        if self.configuration != Configuration.RELEASE or not Config.bench_tag():
+            return []
+        return list_tests(self._catch_path, self.configuration, self._listings, self._timings, Config.bench_tag())
+
+    def run_tests(self, test_cases, workers = 1, on_result = None):
+        """Runs test cases in a pool of workers, results are returned in the
+        same order as test cases were given. In batch mode cases are split
+        between workers and every worker runs its part in one process, cases
+        which did not finish there are rerun one by one. When on_result is
+        given, it is called with every finished case and what it returns is
+        kept instead of the result. Benchmark cases run last, one by one.
+        Cases are started in TEST_ORDER, after FAIL_FAST crashes the cases
+        which did not start yet are skipped."""
+        logger.info('Running %d tests in configuration "%s" with %d workers.', len(test_cases), str(self.configuration), workers)
+
+        benchmarks = [test_case for test_case in test_cases if test_case in self.benchmark_cases]
+        for test_case in benchmarks:
+            self._budget.plan(self._phase(test_case), Config.test_cost() * (Config.bench_warmup() + Config.bench_runs()))
+
+        all_cases, test_cases = test_cases, self._order([test_case for test_case in test_cases if test_case not in benchmarks])
+        for test_case in test_cases:
+            self._budget.plan(self._phase(test_case), Config.test_cost())
+
+        crashes = 0
+        lock = threading.Lock()
+
+        def stopped():
+            return Config.fail_fast() > 0 and crashes >= Config.fail_fast()
+
+        def run(chunk, runner):
+            nonlocal crashes
+            with self._slots:
+                if stopped():
+                    results = {test_case: self._skip(test_case, crashes) for test_case in chunk}
+                else:
+                    results = runner(chunk, workers)
+
+            with lock:
+                for test_case, result in results.items():
+                    if result.get_status() == TestResultStatus.SKIPPED:
+                        continue
+                    self._budget.learn_outcome(self._phase(test_case), result.get_status() != TestResultStatus.SUCCESS)
+                    crashes += is_crash(result)
+
+            if on_result is not None:
+                results = {name: on_result(name, result) for name, result in results.items()}
+            return results
+
+        def run_isolated(chunk, parallel):
+            return {chunk[0]: self.run_test(chunk[0], parallel)}
+
+        results = {}
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            if Config.batch_tests() and len(test_cases) > 1:
+                chunks = [test_cases[i::workers] for i in range(min(workers, len(test_cases)))]
+                for result in executor.map(lambda chunk: run(chunk, self.run_batch), chunks):
+                    results.update(result)
+
+            remaining = [[test_case] for test_case in test_cases if test_case not in results]
+            for chunk in remaining: # batches consumed the plan of their cases
+                self._budget.plan(self._phase(chunk[0]), Config.test_cost())
+            for result in executor.map(lambda chunk: run(chunk, run_isolated), remaining):
+                results.update(result)
+
+        for test_case in benchmarks:
+            result = self._skip(test_case, crashes) if stopped() else self.run_benchmark(test_case)
+            results[test_case] = on_result(test_case, result) if on_result is not None else result
+
+        return {test_case: results[test_case] for test_case in all_cases}
+
+    def _env(self):
+        env = {
+            'DATAPATH': Config.data_path(),
+        }
+        if self._submission_path:
+            env['SUBMISSIONPATH'] = self._submission_path
 
-        if catch.returncode != 0 and len(catch.stderr) != 0:
-            logger.error('Cannot list unittests from binary "%s" errno %d', self.binary, catch.returncode)
-            stderr = (catch.stderr or b'').decode('utf-8')
-            raise ListTestsError(catch.returncode, stderr, self.binary)
+        return env
 
-        stdout = catch.stdout.decode('utf-8')
-        logger.debug('List of all tests returned "%s"', stdout)
+    def _execute(self, catch_path, args, temp_dir, env, stdout, stderr, prefix = ()):
+        pw_record = pwd.getpwnam("apc-test")
+        user_uid = pw_record.pw_uid
+        user_gid = pw_record.pw_gid
 
-        return stdout.splitlines()
+        logger.debug('Starting tests file %s, with arguments "%s" current working directory "%s"', catch_path, ', '.join(args), temp_dir)
 
-    def run_test(self, test_case, submission_binary = None):
+        return tester.process.Process([*prefix, catch_path, *args], stdout, stderr,
+            sandbox=Sandbox.create(self.configuration),
+            # preexec_fn is not safe with threads, let subprocess demote us
+            user=user_uid,
+            group=user_gid,
+            cwd=temp_dir,
+            env=env)
+
+    @staticmethod
+    def _capture():
+        return tester.process.OutputCapture(*Config.output_limits())
+
+    def _phase(self, test_case):
+        return f'tests/{self.configuration}/{test_case}'
+
+    @staticmethod
+    def _test_spec(test_case):
+        return test_case.replace(',', '\\,') # comma in test is not allowed, you need to escape it
+
+    @staticmethod
+    def _watchdog(process, name):
+        """Stops the process when it stops using cpu (IDLE_TIMEOUT), None when
+        the watchdog is disabled."""
+        if Config.idle_timeout() <= 0:
+            return None
+
+        def on_idle():
+            logger.info('Test "%s" used no cpu for %s seconds, it will be stopped.', name, Config.idle_timeout())
+            process.kill()
+        return tester.process.IdleWatchdog(process, Config.idle_timeout(), on_idle)
+
+    def run_test(self, test_case, parallel = 1):
         logger.info('Running test "%s" in configuration "%s".', test_case, str(self.configuration))
 
-        temp_dir = tempfile.mkdtemp()
-        logger.debug('Using folder "%s"', temp_dir)
+        grant = self._budget.grant(self._phase(test_case), cap=Config.test_timeout_cap(), parallel=parallel, default=Config.test_cost())
+        with self._timings.phase(self._phase(test_case)) as phase, grant as grant:
+            result = self._run_case(test_case, grant.timeout)
+            if result.get_status() == TestResultStatus.TIMEOUT:
+                grant.expire()
+
+            phase['returncode'] = result.returncode
+
+        return result
+
+    def _order(self, test_cases):
+        """Cheap cases which often failed before go first, so fail fast stops
+        hopeless submissions soon. Cases without history fail with
+        probability one half."""
+        if Config.test_order() != 'history':
+            return test_cases
+
+        def key(test_case):
+            phase = self._phase(test_case)
+            cost = self._budget.plan(phase, Config.test_cost())
+            return cost / max(self._budget.failure_rate(phase, 0.5), 0.05)
+        return sorted(test_cases, key=key)
+
+    def _skip(self, test_case, crashes):
+        logger.info('Skipping test "%s" after %d crashes.', test_case, crashes)
+        self._budget.cancel(self._phase(test_case))
+        return TestResult(None, '', f'Skipped after {crashes} crashed tests.', status=TestResultStatus.SKIPPED)
+
+    @contextlib.contextmanager
+    def _exclusive(self):
+        # benchmark takes all slots, one benchmark at a time takes them, so
+        # two of them never end up holding a part each
+        with self._exclusive_lock:
+            for _ in range(self._workers):
+                self._slots.acquire()
+        try:
+            yield
+        finally:
+            for _ in range(self._workers):
+                self._slots.release()
+
+    @staticmethod
+    def _pin():
+        """Cpu and command pinning the test to it, the last cpu is the least
+        likely to handle interrupts."""
+        if shutil.which('taskset') is None:
+            return None, ()
+        cpu = max(os.sched_getaffinity(0))
+        return cpu, ('taskset', '--cpu-list', str(cpu))
+
+    @staticmethod
+    def _thresholds():
+        """Thresholds of benchmarks by test case, entries without positive
+        reference or with max_ratio which is not a number are ignored."""
+        try:
+            with open(Config.bench_thresholds()) as f:
+                thresholds = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logger.warning('Cannot load benchmark thresholds: %s', e)
+            return {}
+
+        if not isinstance(thresholds, dict):
+            logger.warning('Benchmark thresholds must be an object with test cases as keys')
+            return {}
+
+        def number(value):
+            return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+        result = {}
+        for name, threshold in thresholds.items():
+            if not isinstance(threshold, dict) or not number(threshold.get('reference')) or threshold['reference'] <= 0 \
+                    or not number(threshold.get('max_ratio', 1.0)):
+                logger.warning('Ignoring invalid benchmark threshold of "%s": %s', name, threshold)
+                continue
+            result[name] = dict(threshold, max_ratio=threshold.get('max_ratio', 1.0))
+
+        return result
+
+    def run_benchmark(self, test_case):
+        """Runs test case BENCH_WARMUP + BENCH_RUNS times while no other test
+        runs, pinned to one cpu when possible. Returns result of the last run
+        with statistics of measured runs (durations reported by catch2 and
+        resources), a failed run is returned right away."""
+        logger.info('Benchmarking test "%s" in configuration "%s".', test_case, str(self.configuration))
+
+        warmup, runs = Config.bench_warmup(), Config.bench_runs()
+        cap = Config.test_timeout_cap()
+        if cap is not None:
+            cap *= warmup + runs
+
+        measured = []
+        grant = self._budget.grant(self._phase(test_case), cap=cap, default=Config.test_cost() * (warmup + runs))
+        with self._exclusive(), self._timings.phase(self._phase(test_case), benchmark=True) as phase, grant as grant:
+            cpu, prefix = self._pin()
+            deadline = time.monotonic() + grant.timeout
+            for i in range(warmup + runs):
+                result = self._run_case(test_case, max(0, deadline - time.monotonic()), prefix)
+                if result.get_status() != TestResultStatus.SUCCESS:
+                    break
+                if i >= warmup:
+                    measured.append(result)
+
+            if result.get_status() == TestResultStatus.TIMEOUT:
+                grant.expire()
+            phase['returncode'] = result.returncode
+
+        if len(measured) < runs:
+            return result
+
+        durations = {}
+        for run in measured:
+            for match in self.DURATION.finditer(run.stdout):
+                durations.setdefault(match[2].strip(), []).append(float(match[1]))
+
+        result.benchmark = {
+            'warmup': warmup,
+            'runs': runs,
+            'cpu': cpu,
+            'durations': {name: describe(values) for name, values in durations.items()},
+            'resources': {key: describe([run.resources.get(key, 0) for run in measured])
+                for key in ['wall_time', 'user_time', 'system_time', 'max_rss_kb']},
+        }
 
-        catch_path = os.path.join(temp_dir, self.CATCH_EXEC_NAME)
-        shutil.copy2(self.binary, catch_path)
+        threshold = self._thresholds().get(test_case)
+        if threshold is not None:
+            # duration of the whole case, wall time when catch2 did not report it
+            median = result.benchmark['durations'].get(test_case, result.benchmark['resources']['wall_time'])['median']
+            ratio = median / threshold['reference']
+            passed = ratio <= threshold['max_ratio']
+            result.benchmark['threshold'] = dict(threshold, ratio=round(ratio, 6), passed=passed)
+            if not passed:
+                result.status = TestResultStatus.FAILED
+                result.stderr += f'\nBenchmark median {median:.3f} s is {ratio:.2f} times the reference, at most {threshold["max_ratio"]} is allowed!'
 
-        os.chmod(temp_dir, 0o777) # everyone os allowed to do everything
-        os.chmod(catch_path, 0o777)
+        return result
 
-        pw_record = pwd.getpwnam("apc-test")
-        user_uid = pw_record.pw_uid
-        user_gid = pw_record.pw_gid
+    def _run_case(self, test_case, timeout, prefix = ()):
+        """Runs test case once, prefix is a command the test is started with."""
+        catch_path, env = self._catch_path, self._env()
 
-        env = {
-            'DATAPATH': Config.data_path(),
-        }
-        if submission_binary:
-            submission_path = os.path.join(temp_dir, self.SUBMISSION_EXEC_NAME)
-            shutil.copy2(submission_binary, submission_path)
-            env['SUBMISSIONPATH'] = submission_path
-
-        args = [*self._options, test_case.replace(',', '\,')] # comma in test is not allowed, you need to escape it
+        args = [*self._options, self._test_spec(test_case)]
 
-        logger.debug('Starting tests file %s, with arguments "%s" current working directory "%s"', catch_path, ', '.join(args), temp_dir)
+        stdout, stderr = self._capture(), self._capture()
 
-        def demote(user_uid, user_gid):
-            os.setgid(user_gid)
-            os.setuid(user_uid)
+        # once a sanitizer or debug containers report an error the status is
+        # known, give the report a moment to be finished and stop the test
+        matcher = SignatureMatcher(stderr)
+        killer = None
 
-        with TimeoutManager() as timeout:
-            try:
-                catch = subprocess.run([catch_path, *args],
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE,
-                    preexec_fn=lambda: demote(user_uid, user_gid),
-                    timeout=timeout if Config.get_mode() == SubmissionMode.BUILD else min(timeout, 180),
-                    cwd=temp_dir,
-                    env=env)
+        with self._staging.scratch() as temp_dir:
+            process = self._execute(catch_path, args, temp_dir, env, stdout, matcher, prefix)
 
-                stdout = catch.stdout.decode('raw_unicode_escape')
-                stderr = catch.stderr.decode('raw_unicode_escape')
+            def on_match(status):
+                nonlocal killer
+                logger.info('Test reported "%s", it will be stopped.', status.value)
+                killer = threading.Timer(Config.signature_grace(), process.kill)
+                killer.start()
+            matcher.on_match(on_match)
+            watchdog = self._watchdog(process, test_case)
 
-                logger.info('Test finished errno: %d', catch.returncode)
-                logger.debug('Test stdout: "%s"\n stderr: "%s"', stdout, stderr)
+            try:
+                returncode = process.wait(timeout)
 
-                return TestResult(catch.returncode, stdout, stderr)
+                logger.info('Test finished errno: %d', returncode)
             except subprocess.TimeoutExpired:
                 logger.info('Test timeouted.')
                 # first negative number that cannot be represented with 32 bit signed int (assuming 2-complement)
-                return TestResult(-2147483649, '', 'Subprocess timeout expired!')
+                returncode = -2147483649
+                stderr.write(b'\nSubprocess timeout expired!')
+            finally:
+                if killer is not None:
+                    killer.cancel()
+                if watchdog is not None:
+                    watchdog.stop()
+
+            deadlock = watchdog is not None and watchdog.idle and matcher.status is None
+            if deadlock:
+                stderr.write(f'\nTest used no cpu for {Config.idle_timeout()} seconds, it was stopped!'.encode())
+
+        result = TestResult(returncode,
+            stdout.text(), stderr.text(),
+            stdout.size, stderr.size, process.resources)
+
+        if matcher.status is not None:
+            result.signature = {'status': matcher.status, 'time': matcher.time}
+        if deadlock:
+            result.status = TestResultStatus.DEADLOCK
+
+        logger.debug('Test resources %s', result.resources)
+        logger.debug('Test stdout (%d bytes): "%s"\n stderr (%d bytes): "%s"', result.stdout_size, result.stdout, result.stderr_size, result.stderr)
+        return result
+
+    def run_batch(self, test_cases, parallel = 1):
+        """Runs all test cases in one process with xml reporter. Returns results
+        only for cases, that can be trusted, the rest should be rerun in
+        isolation."""
+        logger.info('Running %d tests in batch in configuration "%s".', len(test_cases), str(self.configuration))
+
+        catch_path, env = self._catch_path, self._env()
+
+        args = [*self._options, '--reporter', 'xml', *map(self._test_spec, test_cases)]
+
+        # xml is parsed as it comes, only finished cases are kept in memory
+        report, capture = XmlReport(self._capture), self._capture()
+
+        cap = Config.test_timeout_cap()
+        if cap is not None:
+            cap *= len(test_cases)
+
+        name = f'tests/{self.configuration}/batch/{test_cases[0]}'
+        phases = [self._phase(test_case) for test_case in test_cases]
+        grant = self._budget.grant(name, covers=phases,
+            cap=cap, parallel=parallel, default=Config.test_cost())
+        with self._timings.phase(name, cases=len(test_cases)) as phase, self._staging.scratch() as temp_dir, grant as grant:
+            process = self._execute(catch_path, args, temp_dir, env, report, capture)
+            # deadlocked case is rerun alone, so it gets its status there
+            watchdog = self._watchdog(process, name)
+            try:
+                returncode = process.wait(grant.timeout)
+            except subprocess.TimeoutExpired:
+                logger.info('Batch timeouted.')
+                grant.expire()
+                returncode = None
+            finally:
+                if watchdog is not None:
+                    watchdog.stop()
+
+            phase['returncode'] = returncode
+
+        stderr = capture.text()
+
+        # stderr of processes started by tests is not captured by catch2, so
+        # we cannot tell which case it belongs to, errors reported on exit
+        # (leak sanitizer) have the same problem, such cases are rerun, catch2
+        # exits with the number of failed assertions (newer versions with 42)
+        exit_error = False
+        if report.failures is not None:
+            expected = {0} if report.failures == 0 else {min(report.failures, 255), 42}
+            exit_error = returncode not in expected
+        def trusted(case):
+            if exit_error or is_dbg_container(stderr):
+                return False
+            return case.success or not stderr.strip()
+
+        finished = [test_case for test_case in test_cases if test_case in report.cases and trusted(report.cases[test_case])]
+
+        logger.info('Batch finished errno: %s, %d of %d cases are accepted.', returncode, len(finished), len(test_cases))
+        logger.debug('Batch stderr: "%s"', stderr)
+        logger.info('Batch resources %s', process.resources)
+
+        results = {}
+        for test_case in finished:
+            case = report.cases[test_case]
+            self._budget.learn(self._phase(test_case), case.duration)
+            # the summary is short, only output of the case is capped
+            stdout = case.stdout.text().strip()
+            results[test_case] = TestResult(0 if case.success else 1,
+                case.summary + (stdout + '\n' if stdout else ''),
+                case.stderr.text().strip(),
+                len(case.summary.encode()) + case.stdout.size, case.stderr.size,
+                # only duration is known for a case, the rest is for whole batch
+                {'wall_time': case.duration})
+
+        return results
@@ -1,23 +1,144 @@
 import logging
-import os
+import contextlib
+import threading
 import time
-import math
+
+from tester.config import Config
 
 logger = logging.getLogger(__name__)
 
-class TimeoutManager:
-    # we will keep 15s for mantainance in this python app, it should be very 
-    # generous and should be enough for everyone
-    TIMEOUT = max(int(os.getenv('TIMEOUT', '500')) - 15, 0)
+class Grant:
+    def __init__(self, name, covers, cost, timeout):
+        self.name = name
+        self.covers = covers
+        self.cost = cost
+        self.timeout = timeout
+        self.expired = False
+
+    def expire(self):
+        # ran out of time, such run only says the cost is at least timeout
+        self.expired = True
+
+
+class TimeBudget:
+    """Wall clock budget of the whole run (TIMEOUT from docker). Phases and
+    test cases which are still ahead are planned with their expected cost
+    (from history or the declared default), which is used for ordering and
+    reporting. Every phase may use all the time left except a small floor
+    (GRANT_FLOOR) kept for each phase still ahead, so a slow case is not
+    killed because of guessed costs of the others. Part of the budget is
+    kept for writing results."""
+
+    def __init__(self, total, reserve):
+        self.total = total
+        self.reserve = reserve
+        self.deadline = time.monotonic() + max(total - reserve, 0)
+        self.history = None
+        self._lock = threading.Lock()
+        self._planned = {}
+        self._phases = {}
+
+    def restart(self):
+        # for jobs that waited before they could start
+        self.deadline = time.monotonic() + max(self.total - self.reserve, 0)
+
+    def use_history(self, history):
+        self.history = history
+
+    def _cost(self, name, default):
+        if self.history is None:
+            return default
+        return self.history.cost(name, default)
+
+    def remaining(self):
+        return max(0.0, self.deadline - time.monotonic())
+
+    def plan(self, name, default):
+        """Phase name is expected to run later, its cost is default unless
+        it is known from previous runs."""
+        cost = self._cost(name, default)
+        with self._lock:
+            self._planned[name] = cost
+        return cost
+
+    def cancel(self, name):
+        """Phase name and all phases nested in it (name/...) will not run."""
+        with self._lock:
+            for planned in [p for p in self._planned if p == name or p.startswith(f'{name}/')]:
+                del self._planned[planned]
+
+    def learn(self, name, duration):
+        if self.history is not None:
+            self.history.record(name, duration)
+
+    def learn_bound(self, name, duration):
+        # phase did not finish, it takes at least duration
+        if self.history is not None:
+            self.history.record_bound(name, duration)
+
+    def learn_outcome(self, name, failed):
+        if self.history is not None:
+            self.history.record_outcome(name, failed)
+
+    def failure_rate(self, name, default):
+        if self.history is None:
+            return default
+        return self.history.failure_rate(name, default)
+
+    @contextlib.contextmanager
+    def grant(self, name, covers=None, cap=None, parallel=1, default=0.0, floor=None):
+        """Time for phase name, which does the work of planned phases covers
+        (just name by default). Up to parallel phases run at the same time.
+        With floor the phase gets at least that much when it is left."""
+        covers = [name] if covers is None else list(covers)
+        parallel = max(1, parallel)
+
+        with self._lock:
+            cost = sum(self._planned.pop(c, self._cost(c, default)) for c in covers)
+            ahead = len(self._planned)
+            remaining = self.remaining()
+
+            # everything except the floor of phases ahead (parallel of them
+            # share it), at least the floor when there is that much left
+            floor = Config.grant_floor()
+            timeout = max(min(remaining, floor), remaining - ahead * floor / parallel)
+            if cap is not None:
+                timeout = min(timeout, cap)
+            if floor is not None:
+                timeout = max(timeout, min(floor, remaining))
+
+        logger.debug('Phase "%s" expected %.1fs, granted %.1fs of remaining %.1fs', name, cost, timeout, remaining)
+
+        grant = Grant(name, covers, cost, timeout)
+        start = time.monotonic()
+        try:
+            yield grant
+        finally:
+            used = time.monotonic() - start
+            with self._lock:
+                self._phases[name] = {
+                    'expected': round(cost, 3),
+                    'granted': round(timeout, 3),
+                    'used': round(used, 3),
+                    'expired': grant.expired,
+                }
+
+            # time of a phase covering several others cannot be split
+            if covers == [name]:
+                if grant.expired:
+                    self.learn_bound(name, max(used, timeout))
+                else:
+                    self.learn(name, used)
 
-    def __init__(self):
-        logger.debug('Current remaining timeout is %ds', self.__class__.TIMEOUT)
+    def report(self):
+        with self._lock:
+            return {
+                'timeout': self.total,
+                'reserve': self.reserve,
+                'remaining': round(self.remaining(), 3),
+                'phases': dict(self._phases),
+            }
 
-    def __enter__(self):
-        self.start = time.perf_counter()
-        return self.__class__.TIMEOUT
 
-    def __exit__(self, type, value, traceback):
-        del type, value, traceback # unused
-        elapsed = math.ceil(time.perf_counter() - self.start)
-        self.__class__.TIMEOUT = max(0, self.__class__.TIMEOUT - elapsed)
+# one for the whole process, it starts together with the container
+budget = TimeBudget(Config.timeout(), Config.output_reserve())
@@ -0,0 +1,78 @@
+import logging
+import contextlib
+import threading
+import time
+import json
+
+logger = logging.getLogger(__name__)
+
+class Timings:
+    """Collects how long phases of the run took (monotonic clock), phases
+    may run in several threads at once and may be nested."""
+
+    def __init__(self):
+        self._start = time.monotonic()
+        self._started = time.time()
+        self._lock = threading.Lock()
+        self._phases = []
+        self._threads = {}
+
+    @contextlib.contextmanager
+    def phase(self, name, **args):
+        """Measures the block, yields dict of args which is stored with the
+        phase, so details known only at the end can be added."""
+        start = time.monotonic()
+        try:
+            yield args
+        finally:
+            end = time.monotonic()
+            thread = threading.current_thread()
+            with self._lock:
+                self._threads[thread.native_id] = thread.name
+                self._phases.append({
+                    'name': name,
+                    'start': round(start - self._start, 6),
+                    'duration': round(end - start, 6),
+                    'thread': thread.native_id,
+                    'args': args,
+                })
+
+    def phases(self):
+        with self._lock:
+            return sorted(self._phases, key=lambda phase: phase['start'])
+
+    def dump(self, path):
+        with open(path, 'w') as f:
+            json.dump({
+                'started': self._started,
+                'total': round(time.monotonic() - self._start, 6),
+                'phases': self.phases(),
+            }, f, indent=2, default=str)
+
+    def dump_trace(self, path):
+        """Writes phases in chrome trace event format (chrome://tracing,
+        ui.perfetto.dev)."""
+        with self._lock:
+            threads = dict(self._threads)
+
+        events = [{
+            'name': 'thread_name', 'ph': 'M', 'pid': 1, 'tid': tid, 'args': {'name': name},
+        } for tid, name in threads.items()]
+
+        events.extend({
+            'name': phase['name'],
+            'cat': phase['name'].split('/')[0],
+            'ph': 'X',
+            'ts': int(phase['start'] * 1e6),
+            'dur': int(phase['duration'] * 1e6),
+            'pid': 1,
+            'tid': phase['thread'],
+            'args': phase['args'],
+        } for phase in self.phases())
+
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f, default=str)
+
+
+# one for the whole process, it starts together with the container
+timings = Timings()
@@ -0,0 +1,60 @@
+import unittest
+
+from tester.process import OutputCapture
+from tester.report import XmlReport
+
+def capture(data, head=10, tail=10):
+    result = OutputCapture(head, tail)
+    result.write(data)
+    return result
+
+class OutputCaptureTest(unittest.TestCase):
+    def test_short_output_is_kept(self):
+        self.assertEqual(capture('žž'.encode()).text(), 'žž')
+
+    def test_multibyte_output_is_cut_between_characters(self):
+        for prefix in range(4):
+            for head, tail in [(10, 10), (9, 9), (11, 7)]:
+                text = capture(('x' * prefix + 'ž€😀' * 20).encode(), head, tail).text()
+                self.assertNotIn('�', text)
+                self.assertIn('bytes truncated', text)
+
+        self.assertEqual(capture(('ž' * 30).encode()).text(),
+            'žžžžž\n[... 40 bytes truncated, 60 bytes total ...]\nžžžžž')
+
+    def test_escapes_are_not_decoded(self):
+        self.assertTrue(capture(b'ab\\u0041cdefghijklmnopqrst', 4, 4).text().startswith('ab\\u'))
+
+class XmlReportTest(unittest.TestCase):
+    def test_case_output_is_capped_while_parsing(self):
+        xml = ('<?xml version="1.0" encoding="UTF-8"?><Catch2TestRun name="x">'
+            '<TestCase name="a"><OverallResult success="true" durationInSeconds="0.5">'
+            f'<StdOut>{"ž" * 5000}</StdOut><StdErr>err</StdErr></OverallResult></TestCase>'
+            '<TestCase name="b">').encode()
+
+        report = XmlReport(lambda: OutputCapture(10, 10))
+        # chunks split multibyte characters too
+        for start in range(0, len(xml), 7):
+            report.feed(xml[start:start + 7])
+
+        self.assertEqual(list(report.cases), ['a'])
+        case = report.cases['a']
+        self.assertTrue(case.success)
+        self.assertEqual(case.stdout.size, 10000)
+        self.assertEqual(case.stdout.text(), 'žžžžž\n[... 9980 bytes truncated, 10000 bytes total ...]\nžžžžž')
+        self.assertEqual(case.stderr.text(), 'err')
+
+    def test_failed_assertions_of_run(self):
+        xml = ('<?xml version="1.0" encoding="UTF-8"?><Catch2TestRun name="x">'
+            '<TestCase name="a"><Section name="s"><OverallResults successes="0" failures="9"/></Section>'
+            '<OverallResult success="false"/></TestCase>'
+            '<OverallResults successes="1" failures="2" expectedFailures="0"/>'
+            '<OverallResultsCases successes="0" failures="1" expectedFailures="0"/></Catch2TestRun>').encode()
+
+        report = XmlReport(lambda: OutputCapture(10, 10))
+        self.assertIsNone(report.failures)
+        report.feed(xml)
+        self.assertEqual(report.failures, 2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,31 @@
+import unittest
+
+from tester.results import ResultWriter
+
+def writer(limit):
+    # _cap only needs the limit, no job or spool
+    result = ResultWriter.__new__(ResultWriter)
+    result._limit = limit
+    return result
+
+class CapTest(unittest.TestCase):
+    def test_short_text_is_kept(self):
+        self.assertEqual(writer(10)._cap('žžž'), 'žžž')
+        self.assertEqual(writer(0)._cap('ž' * 100), 'ž' * 100)
+
+    def test_non_ascii_text_is_cut_by_characters(self):
+        for k in range(4):
+            text = 'x' * k + 'ž' * 20
+            capped = writer(10)._cap(text)
+            self.assertTrue(capped.startswith(text[:5]))
+            self.assertTrue(capped.endswith('ž' * 5))
+            self.assertIn(f'[... {len(text) - 10} characters truncated, {len(text)} characters total ...]', capped)
+            self.assertNotIn('\\u', capped)
+
+    def test_odd_limit(self):
+        capped = writer(3)._cap('abcdefgh')
+        self.assertTrue(capped.startswith('a\n'))
+        self.assertTrue(capped.endswith('\ngh'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,29 @@
+import io
+import unittest
+
+from tester.tests import SignatureMatcher, TestResultStatus
+
+def match(*chunks):
+    sink = io.BytesIO()
+    matcher = SignatureMatcher(sink)
+    for chunk in chunks:
+        matcher.write(chunk)
+    return matcher, sink
+
+class SignatureMatcherTest(unittest.TestCase):
+    def test_address_sanitizer_is_matched_across_writes(self):
+        matcher, sink = match(b'==1==ERROR: Address', b'Sanitizer: heap-use-after-free\n')
+        self.assertEqual(matcher.status, TestResultStatus.ADDR_SANITIZER)
+        self.assertEqual(sink.getvalue(), b'==1==ERROR: AddressSanitizer: heap-use-after-free\n')
+
+    def test_debug_containers_are_matched(self):
+        matcher, _ = match(b'/usr/include/c++/debug/vector:1 In function:\n', b'Error: attempt to subscript __debug::vector\n')
+        self.assertEqual(matcher.status, TestResultStatus.DBG_CONTAINERS)
+
+    def test_leaks_do_not_stop_the_test(self):
+        # child process of the test can leak, the test still decides
+        matcher, _ = match(b'==2==ERROR: LeakSanitizer: detected memory leaks\n')
+        self.assertIsNone(matcher.status)
+
+if __name__ == '__main__':
+    unittest.main()